@@ -0,0 +1,114 @@
+#!/usr/bin/env python2
+"""Pre-aggregates dups files for plotting.
+
+Streams every .dups file in the given directories (or the given files) in a
+process pool and writes a compact histogram table of dupSize counts per
+Version (directory) and Genome (file name without .dups), along with summary
+statistics. plotScaffoldGapDups and plotChangeInScaffoldGapDups accept the
+histogram table with --histogram in place of the dups files.
+
+Bins follow ggplot2's geom_histogram default: bins of binSize centered on
+multiples of binSize and closed on the right, so the plots are unchanged.
+"""
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+
+def dupsFiles(paths):
+    """Returns (version, genome, path) for each dups file. A directory's
+    .dups files take the directory as their version, as in
+    plotChangeInScaffoldGapDups; a file's version is its directory."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.dups'):
+                    files.append((path, os.path.splitext(name)[0],
+                                  os.path.join(path, name)))
+        else:
+            version = os.path.dirname(path) or '.'
+            genome = os.path.splitext(os.path.basename(path))[0]
+            files.append((version, genome, path))
+    return files
+
+
+def binCenter(dupSize, binSize):
+    """Center of the (center - binSize/2, center + binSize/2] bin."""
+    half = binSize / 2.0
+    return int(-((half - dupSize) // binSize) * binSize)
+
+
+def aggregate(args):
+    """Bins the dupSize column of one dups file, streaming it.
+
+    Returns (version, genome, {binCenter: count}, summary) where summary
+    is (dups, total dupSize, min, max, total dupPctID)."""
+    version, genome, path, binSize = args
+    counts = {}
+    dups = totalSize = totalPctID = 0
+    minSize = maxSize = None
+    with open(path) as dupsf:
+        next(dupsf)  # Header
+        for line in dupsf:
+            stats = line.split()
+            if len(stats) < 5:
+                continue
+            dupSize = int(stats[3])
+            center = binCenter(dupSize, binSize)
+            counts[center] = counts.get(center, 0) + 1
+            dups += 1
+            totalSize += dupSize
+            totalPctID += float(stats[4])
+            minSize = dupSize if minSize is None else min(minSize, dupSize)
+            maxSize = dupSize if maxSize is None else max(maxSize, dupSize)
+    return version, genome, counts, (dups, totalSize, minSize, maxSize,
+                                     totalPctID)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+',
+                        help='directories containing dups files, or dups files')
+    parser.add_argument('--output', required=True,
+                        help='histogram table to write')
+    parser.add_argument('--summary', help='summary statistics table to write')
+    parser.add_argument('--binSize', type=int, default=10,
+                        help='dupSize histogram bin size')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    opts = parser.parse_args()
+
+    jobs = [(version, genome, path, opts.binSize)
+            for version, genome, path in dupsFiles(opts.paths)]
+    pool = Pool(opts.processes)
+    try:
+        results = pool.map(aggregate, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    with open(opts.output, 'w') as outfile:
+        outfile.write('Version\tGenome\tbinCenter\tbinSize\tcount\n')
+        for version, genome, counts, _ in results:
+            for center in sorted(counts):
+                outfile.write("{}\t{}\t{}\t{}\t{}\n".format(
+                    version, genome, center, opts.binSize, counts[center]))
+
+    if opts.summary is not None:
+        with open(opts.summary, 'w') as outfile:
+            outfile.write('Version\tGenome\tdups\tmeanDupSize\tminDupSize'
+                          '\tmaxDupSize\tmeanDupPctID\n')
+            for version, genome, _, summary in results:
+                dups, totalSize, minSize, maxSize, totalPctID = summary
+                if dups == 0:
+                    outfile.write("{}\t{}\t0\tNA\tNA\tNA\tNA\n".format(
+                        version, genome))
+                    continue
+                outfile.write("{}\t{}\t{}\t{:.1f}\t{}\t{}\t{:.2f}\n".format(
+                    version, genome, dups, float(totalSize) / dups, minSize,
+                    maxSize, totalPctID / dups))
+
+
+if __name__ == '__main__':
+    main()
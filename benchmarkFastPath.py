@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+"""Checks the exact-overlap fast path against blat.
+
+Simulated gap flanks (unique sequence, and overlaps inside tandem repeats,
+each with a few substitutions) are aligned with both exactOverlap and
+blat. Every call the fast path makes should agree with blat; the cases it
+leaves to blat are counted, and disagreements are printed.
+"""
+import random
+import time
+from argparse import ArgumentParser
+from findScaffoldGapDups import alignWithBlat, exactOverlap
+
+KINDS = ('unique', 'repeat')
+
+
+def randomBases(rng, size, alphabet='ACGT'):
+    return ''.join(rng.choice(alphabet) for _ in range(size))
+
+
+def mutate(rng, sequence, substitutions):
+    """Returns sequence with some bases substituted at random positions."""
+    bases = list(sequence)
+    for _ in range(substitutions):
+        i = rng.randrange(len(bases))
+        bases[i] = rng.choice([b for b in 'ACGT' if b != bases[i]])
+    return ''.join(bases)
+
+
+def simulatedFlanks(rng, kind, flankSize, maxSubstitutions):
+    """Returns the flanks before and after a simulated gap whose last
+    bases before the gap are repeated, with substitutions, after it."""
+    overlapSize = rng.randint(1, flankSize // 2)
+    if kind == 'repeat':
+        unit = randomBases(rng, rng.randint(2, 12))
+        repeat = unit * (flankSize // len(unit) + 1)
+        overlap = repeat[:overlapSize]
+        before = randomBases(rng, flankSize - overlapSize) + overlap
+        after = mutate(rng, repeat[:overlapSize], rng.randint(
+            0, maxSubstitutions)) + randomBases(rng, flankSize - overlapSize)
+    else:
+        overlap = randomBases(rng, overlapSize)
+        before = randomBases(rng, flankSize - overlapSize) + overlap
+        after = mutate(rng, overlap, rng.randint(0, maxSubstitutions)) + \
+            randomBases(rng, flankSize - overlapSize)
+    return before, after
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--cases', type=int, default=500,
+                        help='simulated gaps of each kind')
+    parser.add_argument('--flankSize', type=int, default=1000,
+                        help='bases on each side of a simulated gap')
+    parser.add_argument('--maxSubstitutions', type=int, default=3,
+                        help='most substitutions made in an overlap')
+    parser.add_argument('--seed', type=int, default=1)
+    opts = parser.parse_args()
+
+    rng = random.Random(opts.seed)
+    print('kind\tcases\tfastCalls\tagree\tdisagree\tfastSeconds\t'
+          'blatSeconds')
+    for kind in KINDS:
+        fastCalls = agree = 0
+        fastSeconds = blatSeconds = 0.0
+        for _ in range(opts.cases):
+            before, after = simulatedFlanks(rng, kind, opts.flankSize,
+                                            opts.maxSubstitutions)
+            start = time.time()
+            fast = exactOverlap(before, after)
+            fastSeconds += time.time() - start
+            start = time.time()
+            blat = alignWithBlat(before, after)
+            blatSeconds += time.time() - start
+            if fast is None:
+                continue
+            fastCalls += 1
+            if fast[0] == blat[0] and abs(fast[1] - blat[1]) < 0.01:
+                agree += 1
+            else:
+                print('# {} disagrees: fast path {} blat {}\n# {}\n# {}'
+                      .format(kind, fast, blat, before, after))
+        print('{}\t{}\t{}\t{}\t{}\t{:.3f}\t{:.3f}'.format(
+            kind, opts.cases, fastCalls, agree, fastCalls - agree,
+            fastSeconds, blatSeconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+"""Measures what MaskFilter settings cost in duplications.
+
+Given a soft-masked assembly and the dups found in it with blat on every
+gap (the reference calls, with the same --maxSize), routes every gap with
+each combination of window and masked fraction, and reports how many
+alignments each would save and how many reference dups it keeps. With
+'skip', dups at masked gaps are lost. With 'exact', masked gaps are
+aligned with alignExactOnly, and its calls are compared with the
+reference: recall counts reference dups that are still called with the
+same size, and precision counts calls that match a reference dup. Both
+the reference dups and the exact calls are filtered with -s and -%, as
+filterDups would.
+
+The reference must come from findScaffoldGapDups.py run without
+--fastPath and without --maskedGaps. The fast path calls overlaps with
+the same exactOverlap that alignExactOnly uses, so a reference made with
+it would agree with the exact calls by construction.
+"""
+from argparse import ArgumentParser
+from filterDups import filterDupRecords
+from findScaffoldGapDups import Dup, MaskFilter, alignExactOnly, hasFlanks
+from gapIndex import openGapIndex
+from indexedFasta import openGenome
+
+
+def referenceDups(path, dupSize, percentID):
+    """Returns the dups of a .dups file, keyed by (sequence, gapStart,
+    gapEnd), keeping those of at least dupSize bases and percentID."""
+    dups = {}
+    with open(path) as f:
+        next(f)  # header
+        for line in f:
+            fields = line.split()
+            dups[(fields[0], int(fields[1]), int(fields[2]))] = \
+                (int(fields[3]), float(fields[4]))
+    return dict((key, size) for key, (size, pctID) in dups.items()
+                if size >= dupSize and pctID >= percentID)
+
+
+def parseList(values, type_):
+    return [type_(value) for value in values.split(',')]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('genome', help='soft-masked 2bit or (bgzip) fasta')
+    parser.add_argument('dups', help='dups found with blat on every gap '
+                        '(without --fastPath or --maskedGaps)')
+    parser.add_argument('--maxSize', type=int, default=5000,
+                        help='--maxSize the reference dups were found with')
+    parser.add_argument('--windows', default='200,500,1000,2000',
+                        help='comma-separated mask windows to try')
+    parser.add_argument('--fractions', default='0.5,0.8,0.9,1.0',
+                        help='comma-separated masked fractions to try')
+    parser.add_argument('-s', help='only count reference dups and exact '
+                        'calls of at least this size', type=int, default=0,
+                        dest='dupSize')
+    parser.add_argument('-%', help='only count reference dups and exact '
+                        'calls of at least this percent identity',
+                        type=float, default=0.0, dest='percentID')
+    opts = parser.parse_args()
+
+    genome = openGenome(opts.genome)
+    gapIndex = openGapIndex(opts.genome, genome=genome)
+    reference = referenceDups(opts.dups, opts.dupSize, opts.percentID)
+    settings = [(window, fraction)
+                for window in parseList(opts.windows, int)
+                for fraction in parseList(opts.fractions, float)]
+    filters = [MaskFilter('exact', window, fraction)
+               for window, fraction in settings]
+    masked = [[] for _ in settings]  # keys of the gaps each setting masks
+    for header in gapIndex.names():
+        sequence = genome[header]
+        for gapStart, gapEnd in gapIndex.gaps(header):
+            if not hasFlanks(gapStart, gapEnd, len(sequence), opts.maxSize):
+                continue
+            for maskFilter, keys in zip(filters, masked):
+                if maskFilter.route(sequence.masked_bases, gapStart, gapEnd,
+                                    len(sequence)) == 'exact':
+                    keys.append((header, gapStart, gapEnd))
+
+    exactCalls = {}  # alignExactOnly calls, shared between settings
+
+    def exactCall(key):
+        if key not in exactCalls:
+            header, gapStart, gapEnd = key
+            sequence = genome[header]
+            size, percentID = alignExactOnly(
+                sequence.get_upper_slice(max(0, gapStart - opts.maxSize),
+                                         gapStart),
+                sequence.get_upper_slice(gapEnd, gapEnd + opts.maxSize))
+            # the dups findDups would report, filtered as the reference is
+            dups = [Dup(header, gapStart, gapEnd, size, percentID)]
+            kept = size > 20 and list(filterDupRecords(dups, opts.dupSize,
+                                                       opts.percentID))
+            exactCalls[key] = size if kept else None
+        return exactCalls[key]
+
+    print('window\tfraction\tgaps\tmasked\treferenceDups\tskipKept\t'
+          'skipRecall\texactKept\texactRecall\texactPrecision')
+    for (window, fraction), maskFilter, keys in zip(settings, filters,
+                                                     masked):
+        lost = [key for key in keys if key in reference]
+        exactFound = exactWrong = 0
+        for key in keys:
+            size = exactCall(key)
+            if size is None:
+                continue
+            if reference.get(key) == size:
+                exactFound += 1
+            else:
+                exactWrong += 1
+        skipKept = len(reference) - len(lost)
+        exactKept = skipKept + exactFound
+        calls = exactKept + exactWrong
+        print('{}\t{:g}\t{}\t{}\t{}\t{}\t{:.4f}\t{}\t{:.4f}\t{:.4f}'.format(
+            window, fraction, maskFilter.counts['checked'], len(keys),
+            len(reference), skipKept,
+            float(skipKept) / len(reference) if reference else 1.0,
+            exactKept,
+            float(exactKept) / len(reference) if reference else 1.0,
+            float(exactKept) / calls if calls else 1.0))
+
+
+if __name__ == '__main__':
+    main()
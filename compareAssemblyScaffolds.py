@@ -3,30 +3,140 @@
 duplications file, returns the assemblies total number of scaffold gaps,
 the number of scaffold gaps found to be apart of a duplication, and a
 percentage based on the ratio of these two values.
+
+With --twoBits/--dups, runs a census over many assemblies at once in a
+process pool and prints one table, with a header, that also summarizes the
+gap-length distribution of each assembly. Gaps are read from the 2bit
+N-block index, so no sequence is decoded, and are kept in the gap sidecar
+index beside each assembly for later runs.
 """
+import os
 from argparse import ArgumentParser
-from twobitreader import TwoBitFile
-from findScaffoldGapDups import findGaps
+from multiprocessing import Pool
+from gapIndex import openGapIndex
+
+
+def genomeLabel(path):
+    """Label an assembly by its file name, up to the first '.'."""
+    return os.path.basename(path).split('.')[0]
+
+
+def gapLengths(twoBit):
+    """Returns a sorted list of the lengths of every scaffold gap in a
+    2bit file, read from its gap sidecar index."""
+    lengths = []
+    index = openGapIndex(twoBit)
+    for name in index.names():
+        lengths.extend(end - start for start, end in
+                       zip(index.starts(name), index.ends(name)))
+    lengths.sort()
+    return lengths
+
+
+def countDups(dups):
+    """Counts the duplications in a dups file, streaming past the header."""
+    with open(dups, 'r') as dupsf:
+        next(dupsf)  # Header
+        return sum(1 for line in dupsf)
+
+
+def gapSummary(lengths, binSize):
+    """Summarizes a sorted list of gap lengths as (gaps, gap bases, median
+    gap size, max gap size, {histogram bin start: count})."""
+    total = len(lengths)
+    median = lengths[total // 2] if total > 0 else 0
+    maximum = lengths[-1] if total > 0 else 0
+    counts = {}
+    for length in lengths:
+        binStart = (length // binSize) * binSize
+        counts[binStart] = counts.get(binStart, 0) + 1
+    return total, sum(lengths), median, maximum, counts
+
+
+def census(args):
+    """Summarizes the gaps and duplications of one 2bit/dups pair.
+
+    Returns a tuple of (label, gapSummary of its gaps, number of dups), so
+    a pool worker sends back only the summary, not every gap length."""
+    label, twoBit, dups, binSize = args
+    return label, gapSummary(gapLengths(twoBit), binSize), countDups(dups)
+
+
+def pctOf(part, total):
+    if total == 0:
+        return 0.0
+    return (float(part) / total) * 100
 
 
 def main():
     parser = ArgumentParser(description=__doc__)
-    parser.add_argument('twobit', help='twobit assembly file')
-    parser.add_argument('dups', help='corresponding dups file')
+    parser.add_argument('twobit', nargs='?', help='twobit assembly file')
+    parser.add_argument('dups', nargs='?', help='corresponding dups file')
+    parser.add_argument('--twoBits', nargs='+', default=[],
+                        help='twobit assembly files for a census')
+    parser.add_argument('--dups', nargs='+', default=[], dest='dupsList',
+                        help='dups files, one per twobit in --twoBits')
+    parser.add_argument('--labels', nargs='+',
+                        help='genome labels, one per twobit in --twoBits '
+                        '(default: dups file name up to the first ".")')
+    parser.add_argument('--histogram',
+                        help='also write gap-length histogram counts here')
+    parser.add_argument('--binSize', type=int, default=10,
+                        help='gap-length histogram bin size')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
     opts = parser.parse_args()
 
-    with open(opts.dups, 'r') as dupsf:
-        next(dupsf)  # Header
-        dupsScaffolds = sum(1 for line in dupsf)
+    if opts.twoBits or opts.dupsList:
+        if opts.twobit is not None:
+            parser.error('give either twobit and dups or --twoBits/--dups')
+        if len(opts.twoBits) != len(opts.dupsList):
+            parser.error('--twoBits and --dups must have the same length')
+        if opts.labels is not None and \
+                len(opts.labels) != len(opts.twoBits):
+            parser.error('--labels and --twoBits must have the same length')
+        runCensus(opts)
+        return
+    if opts.dups is None:
+        parser.error('twobit and dups files are required')
+
+    _, summary, dupsScaffolds = census((None, opts.twobit, opts.dups,
+                                        opts.binSize))
+    total = summary[0]
+    print("{}\t{}\t{}\t{:.2f}".format(genomeLabel(opts.dups), total,
+          dupsScaffolds, pctOf(dupsScaffolds, total)))
+
+
+def runCensus(opts):
+    labels = opts.labels
+    if labels is None:
+        labels = [genomeLabel(dups) for dups in opts.dupsList]
+    jobs = [(label, twoBit, dups, opts.binSize) for label, twoBit, dups
+            in zip(labels, opts.twoBits, opts.dupsList)]
+
+    pool = Pool(opts.processes)
+    try:
+        results = pool.map(census, jobs)
+    finally:
+        pool.close()
+        pool.join()
 
-    total = 0
-    for sequence in TwoBitFile(opts.twobit).itervalues():
-        total += sum(1 for _, _ in findGaps(str(sequence)))
+    print('genome\tgaps\tdupGaps\tpctDupGaps\tgapBases\tmedianGapSize'
+          '\tmaxGapSize')
+    for label, summary, dups in results:
+        total, gapBases, median, maximum, _ = summary
+        print("{}\t{}\t{}\t{:.2f}\t{}\t{}\t{}".format(
+            label, total, dups, pctOf(dups, total), gapBases, median,
+            maximum))
 
-    base = opts.dups.split('/')[-1]
-    base = base.split('.')[0]
-    print("{}\t{}\t{}\t{:.2f}".format(base, total, dupsScaffolds,
-          (float(dupsScaffolds) / total) * 100))
+    if opts.histogram is not None:
+        with open(opts.histogram, 'w') as outfile:
+            outfile.write('genome\tbinStart\tcount\n')
+            for label, summary, _ in results:
+                counts = summary[4]
+                for binStart in sorted(counts):
+                    outfile.write("{}\t{}\t{}\n".format(label, binStart,
+                                                       counts[binStart]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+"""Pre-decoded, memory-mapped copy of an assembly for multi-process runs.
+
+The assembly is decoded once into <assembly>.decoded: one upper-case byte
+per base (Ns filled in, soft-masking dropped), preceded by a table of each
+scaffold's offset and length. Workers memory-map that file, so the operating
+system keeps a single copy of the genome in the page cache however many
+processes read it, and none of them repeats the 2bit decoding.
+
+Like the gap index, the file records the size, mtime and checksum of the
+assembly it was built from (see sidecar) and is rebuilt when they no longer
+match.
+
+Run as a script to build the decoded copy of some assemblies ahead of time.
+"""
+import struct
+from argparse import ArgumentParser
+from indexedFasta import openGenome, toStr
+from sidecar import HEADER, Sidecar, cachePath, openSidecar, packHeader, \
+    writeAtomically
+
+MAGIC = b'DECODED2'
+# name length (name follows), offset of the bases, scaffold length
+ENTRY = struct.Struct('<HQQ')
+SUFFIX = '.decoded'
+# bases decoded at a time when writing
+DECODE_CHUNK = 1 << 22
+
+
+def decodedPath(assembly):
+    return assembly + SUFFIX
+
+
+def writeDecodedGenome(path, assembly, chunkSize=DECODE_CHUNK):
+    """Decodes an assembly into a decoded genome file at path, chunkSize
+    bases at a time."""
+    genome = openGenome(assembly)
+    names = genome.sequence_names()
+    encodedNames = [name.encode('ascii') for name in names]
+    header = packHeader(MAGIC, assembly, len(names))
+
+    def write(f):
+        f.write(header)
+        offset = HEADER.size + sum(ENTRY.size + len(name)
+                                   for name in encodedNames)
+        for name, encoded in zip(names, encodedNames):
+            f.write(ENTRY.pack(len(encoded), offset, len(genome[name])))
+            f.write(encoded)
+            offset += len(genome[name])
+        for name in names:
+            sequence = genome[name]
+            for start in range(0, len(sequence), chunkSize):
+                bases = sequence.get_upper_slice(start, start + chunkSize)
+                f.write(bases.encode('ascii') if not
+                        isinstance(bases, bytes) else bases)
+
+    writeAtomically(path, write)
+
+
+class DecodedGenome(dict, Sidecar):
+    """A memory-mapped decoded genome. Like TwoBitFile, maps scaffold names
+    to sequences that can be sliced."""
+    MAGIC = MAGIC
+    KIND = 'decoded genome'
+
+    def __init__(self, path):
+        super(DecodedGenome, self).__init__()
+        count = self.mapSidecar(path)
+        self._names = []
+        position = HEADER.size
+        for _ in range(count):
+            nameLength, offset, length = ENTRY.unpack_from(self._map,
+                                                           position)
+            position += ENTRY.size
+            name = toStr(self._map[position:position + nameLength])
+            position += nameLength
+            self._names.append(name)
+            self[name] = DecodedSequence(self._map, offset, length)
+
+    def __reduce__(self):  # enables pickling
+        return (DecodedGenome, (self.path,))
+
+    def sequence_names(self):
+        """returns the scaffold names in the order of the assembly"""
+        return list(self._names)
+
+    def sequence_sizes(self):
+        """returns a dictionary with the sizes of each sequence"""
+        return dict((name, len(sequence)) for name, sequence in self.items())
+
+
+class DecodedSequence(object):
+    """A scaffold in a DecodedGenome. Slices are upper-case strings, since
+    soft-masking is not kept."""
+
+    def __init__(self, map_, offset, length):
+        self._map = map_
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, slice_or_key):
+        if isinstance(slice_or_key, slice):
+            if slice_or_key.step is not None:
+                raise ValueError("Slicing by step not currently supported")
+            return self.get_slice(slice_or_key.start, slice_or_key.stop)
+        max_ = slice_or_key + 1
+        if max_ == 0:
+            max_ = None
+        return self.get_slice(slice_or_key, max_)
+
+    def get_slice(self, min_, max_=None):
+        """returns bases [min_, max_) as an upper-case string"""
+        start, stop, _ = slice(min_, max_).indices(self._length)
+        return toStr(self._map[self._offset + start:
+                               self._offset + max(start, stop)])
+
+    get_upper_slice = get_slice
+
+    def __str__(self):
+        return self.get_slice(0, None)
+
+
+def openDecodedGenome(assembly, directory=None, build=True):
+    """Returns the DecodedGenome for an assembly, decoding it first if the
+    decoded copy is missing or stale. Assemblies in read-only directories
+    are decoded into directory, by default the temporary directory.
+    Without build, raises ValueError instead of decoding."""
+    paths = [decodedPath(assembly), cachePath(assembly, SUFFIX, directory)]
+    return openSidecar(assembly, paths, DecodedGenome,
+                       lambda candidate: writeDecodedGenome(candidate,
+                                                            assembly),
+                       build)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('assemblies', nargs='+',
+                        help='2bit or (bgzip) fasta assemblies')
+    opts = parser.parse_args()
+
+    for assembly in opts.assemblies:
+        genome = openDecodedGenome(assembly)
+        print("{}\t{}\t{}".format(genome.path, len(genome),
+                                  sum(genome.sequence_sizes().values())))
+
+
+if __name__ == '__main__':
+    main()
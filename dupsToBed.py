@@ -5,6 +5,16 @@ import remove_overlap
 from argparse import ArgumentParser
 
 
+def bedLines(name, dup):
+    """Returns the BED lines for the duplicated regions above and below the
+    gap of a duplication on sequence name."""
+    aboveStart = dup.gapStart - dup.dupSize
+    behindEnd = dup.gapEnd + dup.dupSize
+    aboveGap = "{}\t{}\t{}".format(name, aboveStart, dup.gapStart)
+    belowGap = "{}\t{}\t{}".format(name, dup.gapEnd, behindEnd)
+    return aboveGap, belowGap
+
+
 def main():
     parser = ArgumentParser(description=__doc__)
     parser.add_argument('dups', help='dups file')
@@ -13,12 +23,8 @@ def main():
     duplication = remove_overlap.parse_dups_file(opts.dups)
     for name, dups in duplication.items():
         for dup in dups:
-            aboveStart = dup.gapStart - dup.dupSize
-            behindEnd = dup.gapEnd + dup.dupSize
-            aboveGap = "{}\t{}\t{}".format(name, aboveStart, dup.gapStart)
-            belowGap = "{}\t{}\t{}".format(name, dup.gapEnd, behindEnd)
-            print(aboveGap)
-            print(belowGap)
+            for line in bedLines(name, dup):
+                print(line)
 
 
 if __name__ == '__main__':
@@ -16,6 +16,17 @@ def filterDups(dupsf, dupSize, percentID):
             yield line.rstrip()
 
 
+def filterDupRecords(dups, dupSize, percentID):
+    """Filters Dup records from findScaffoldGapDups.findDups with the same
+    criteria as filterDups.
+    """
+    for dup in dups:
+        # Compare the identity as it would be written to a dups file
+        if dup.dupSize >= dupSize and \
+                float('{:.1f}'.format(dup.dupPctID)) >= percentID:
+            yield dup
+
+
 def main():
     parser = ArgumentParser(description=__doc__)
     parser.add_argument('dups', help='dups file')
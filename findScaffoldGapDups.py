@@ -1,18 +1,74 @@
 #!/usr/bin/env python2
 """Find the weird tandem duplications around scaffold gaps and report
 their location and size."""
-import re
 import os
-# import subprocess
+import signal
+import subprocess
+import sys
+import threading
+import time
 from argparse import ArgumentParser
+from collections import namedtuple
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 from sonLib.bioio import fastaRead, popenCatch, getTempFile
+from indexedFasta import isGzip, openGenome, sequenceName
+from gapIndex import openGapIndex
+from nRuns import nRuns
 
+DUPS_HEADER = 'sequence\tgapStart\tgapEnd\tdupSize\tdupPctID'
 
-def alignWithBlat(seq1, seq2):
+SLOW_HEADER = 'sequence\tgapStart\tgapEnd\tstatus\tseconds'
+
+Dup = namedtuple('Dup', ['sequence', 'gapStart', 'gapEnd', 'dupSize',
+                         'dupPctID'])
+
+
+class AlignmentTimeout(Exception):
+    pass
+
+
+def popenCatchWithTimeout(command, stdinString, timeout):
+    """Like sonLib's popenCatch, but kills the command and raises
+    AlignmentTimeout if it runs for more than timeout seconds. The command
+    runs in its own process group, which is killed as a whole so no
+    processes it started are left behind."""
+    process = subprocess.Popen(command.split(), stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               universal_newlines=True,
+                               preexec_fn=os.setsid)
+    killed = []
+
+    def kill():
+        killed.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass  # already exited
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output, _ = process.communicate(stdinString)
+    finally:
+        timer.cancel()
+    if killed:
+        raise AlignmentTimeout(command)
+    if process.returncode != 0:
+        raise RuntimeError("Command: %s with stdin string '%s' exited with "
+                           "non-zero status %i" % (command, stdinString,
+                                                   process.returncode))
+    return output
+
+
+def alignWithBlat(seq1, seq2, timeout=None):
     """Special-case of aligning two sequences for which the first part of
     seq2 may be similar to the last part of seq1.
 
-    Returns size and % ID of the alignment."""
+    Returns size and % ID of the alignment. Raises AlignmentTimeout if
+    blat takes more than timeout seconds."""
     seq1Path = getTempFile()
     try:
         with open(seq1Path, 'w') as seq1File:
@@ -23,7 +79,11 @@ def alignWithBlat(seq1, seq2):
         #       " -repMatch=10 -noHead -fastMap stdout".format(seq1Path)
         cmd = "blat {} stdin -q=dna -minIdentity=95 " \
               " -repMatch=10 -noHead stdout".format(seq1Path)
-        output = popenCatch(cmd, stdinString=">\n" + seq2.upper())
+        if timeout is None:
+            output = popenCatch(cmd, stdinString=">\n" + seq2.upper())
+        else:
+            output = popenCatchWithTimeout(cmd, ">\n" + seq2.upper(),
+                                           timeout)
 
         # There may be multiple alignments, but there can be at most one
         # that fits our requirements (starts at 0 in seq1, ends at
@@ -47,44 +107,420 @@ def alignWithBlat(seq1, seq2):
             dupPct = float(stats[0]) / (float(stats[0]) + float(stats[1]))
             dupPct *= 100
             # TODO num of mismatches or size of duplication?
-            return stats[0], dupPct
+            return int(stats[0]), dupPct
         return 0, 0.0
     finally:
         os.remove(seq1Path)
 
 
-def findGaps(sequence):
+def exactOverlap(seq1, seq2, minSize=50, minPctID=95.0, seedSize=12):
+    """Finds the longest ungapped overlap between the end of seq1 and the
+    start of seq2 with at least minPctID identity.
+
+    The candidate is the longest overlap whose first seedSize bases match
+    (found with str.find rather than a Python-level scan). It is only
+    called if the last seedSize bases of seq1 anchor the same overlap in
+    seq2, and it is scored by identity over its whole length. Shorter
+    candidates are never tried, since in a repeat one of them can match
+    exactly where the real overlap has a mismatch. Returns (size,
+    percentID) like alignWithBlat, or None if there is no confident call,
+    in which case the full aligner should decide."""
+    if len(seq1) < seedSize or len(seq2) < seedSize:
+        return None
+    pos = seq1.find(seq2[:seedSize], max(0, len(seq1) - len(seq2)))
+    if pos == -1:
+        return None
+    size = len(seq1) - pos
+    if size < minSize:
+        return None
+    tail = seq2.rfind(seq1[-seedSize:], 0, min(len(seq1), len(seq2)))
+    if tail + seedSize != size:
+        return None
+    overlap1 = seq1[pos:]
+    overlap2 = seq2[:size]
+    # blat counts Ns separately, so leave those to it
+    if 'N' in overlap1 or 'N' in overlap2:
+        return None
+    if overlap1 == overlap2:
+        mismatches = 0
+    else:
+        mismatches = sum(1 for a, b in zip(overlap1, overlap2) if a != b)
+    percentID = 100.0 * (size - mismatches) / size
+    if percentID < minPctID:
+        return None
+    return size - mismatches, percentID
+
+
+def alignWithFastPath(seq1, seq2, timeout=None):
+    """Like alignWithBlat, but calls perfect and near-perfect overlaps
+    with exactOverlap and only runs blat on the rest."""
+    result = exactOverlap(seq1, seq2)
+    if result is None:
+        return alignWithBlat(seq1, seq2, timeout)
+    return result
+
+
+def alignExactOnly(seq1, seq2, timeout=None):
+    """The cheap path for gaps in repeats: calls the overlaps exactOverlap
+    finds and reports no overlap for the rest, without running blat."""
+    result = exactOverlap(seq1, seq2)
+    if result is None:
+        return 0, 0.0
+    return result
+
+
+def stringMaskedBases(sequence):
+    """Returns a maskedBases function for a sequence held as a string."""
+    def maskedBases(start, end):
+        return sum(1 for base in sequence[start:end] if base.islower())
+    return maskedBases
+
+
+class MaskFilter(object):
+    """Decides from the soft mask which gaps are worth aligning.
+
+    A gap is masked when at least maxFraction of the window bases on both
+    sides of it are soft-masked repeat; duplications called there are
+    rarely trustworthy. With action 'exact' masked gaps are aligned with
+    alignExactOnly, which still calls exact and near-exact duplications,
+    and with 'skip' they are not aligned at all, which can also drop real
+    duplications in repeats (benchmarkMaskFilter measures how many). counts
+    records how many gaps were checked, skipped and sent to the exact path.
+    """
+    ACTIONS = ('exact', 'skip')
+
+    def __init__(self, action='exact', window=1000, maxFraction=1.0):
+        if action not in self.ACTIONS:
+            raise ValueError('Unknown masked gap action %s' % action)
+        self.action = action
+        self.window = window
+        self.maxFraction = maxFraction
+        self.counts = {'checked': 0, 'skipped': 0, 'exactOnly': 0}
+
+    def isMasked(self, maskedBases, start, end):
+        return end > start and \
+            maskedBases(start, end) >= self.maxFraction * (end - start)
+
+    def route(self, maskedBases, gapStart, gapEnd, length):
+        """Returns 'align', 'skip' or 'exact' for a gap, counting it.
+        maskedBases(start, end) counts the soft-masked bases in part of
+        the gap's sequence, and length is the sequence's length."""
+        self.counts['checked'] += 1
+        if not (self.isMasked(maskedBases, max(0, gapStart - self.window),
+                              gapStart) and
+                self.isMasked(maskedBases, gapEnd,
+                              min(length, gapEnd + self.window))):
+            return 'align'
+        if self.action == 'skip':
+            self.counts['skipped'] += 1
+            return 'skip'
+        self.counts['exactOnly'] += 1
+        return 'exact'
+
+    def summary(self):
+        return ("checked={checked}\tskipped={skipped}\texactOnly={exactOnly}"
+                .format(**self.counts) +
+                "\treason=at least {:g}% of the {} bases on both sides of "
+                "the gap soft-masked".format(100 * self.maxFraction,
+                                             self.window))
+
+
+def addMaskOptions(parser):
+    """Adds the options configuring a MaskFilter (see maskFilterFor) to an
+    ArgumentParser."""
+    parser.add_argument('--maskedGaps', choices=MaskFilter.ACTIONS,
+                        nargs='?', const='exact',
+                        help='for gaps with soft-masked flanks, only call '
+                        'exact overlaps (exact, the default if no value is '
+                        'given) or skip them (skip, which can drop real '
+                        'duplications in repeats)')
+    parser.add_argument('--maskWindow', type=int, default=1000,
+                        help='bases on each side of a gap checked for '
+                        'soft-masking')
+    parser.add_argument('--maskedFraction', type=float, default=1.0,
+                        help='fraction of the window that must be masked')
+
+
+def maskFilterFor(options):
+    """Returns the MaskFilter for options parsed with addMaskOptions (or
+    any object with the same fields), or None if masked gaps are aligned
+    like any other."""
+    if options.maskedGaps is None:
+        return None
+    return MaskFilter(options.maskedGaps, options.maskWindow,
+                      options.maskedFraction)
+
+
+def hasFlanks(gapStart, gapEnd, length, maxSize):
+    """Checks that a gap has at least 5 bases of flank on both sides; gaps
+    at the end or beginning of a sequence don't have enough information on
+    one or both sides to be useful."""
+    return min(gapStart, maxSize) >= 5 and \
+        min(length - gapEnd, maxSize) >= 5
+
+
+def routedFlanks(key, beforeGap, afterGap, route):
+    """Returns the alignFlanks item for a gap MaskFilter.route did not
+    skip."""
+    if route == 'exact':
+        return key, beforeGap, afterGap, alignExactOnly
+    return key, beforeGap, afterGap
+
+
+def findGaps(sequence, minGapSize=1):
     """Generator yielding the start and ends of a scaffold with any number
-    of Ns.
+    of Ns (at least minGapSize of them).
     """
-    patt = re.compile(r"[Nn]+")
-    for match in patt.finditer(sequence):
-        yield (match.start(), match.end())
+    return nRuns(sequence, minGapSize)
+
+
+def alignFlanks(flanks, aligner=alignWithBlat, workers=1,
+                queueDepth=16, timeout=None):
+    """Generator aligning flank pairs on a pool of worker threads.
+
+    flanks is an iterable of (key, beforeGap, afterGap), optionally followed
+    by an aligner to use for that pair instead; it is consumed by a
+    producer thread, so any sequence fetching it does overlaps with the
+    alignments. At most queueDepth pairs are fetched but not yet yielded,
+    which bounds memory when one alignment is slow.
+
+    Alignments taking more than timeout seconds are abandoned, and their
+    blat process group is killed.
+
+    Yields (key, size, percentID, seconds, status) in the same order as
+    flanks, where status is 'ok' or 'timedOut' (with size and percentID
+    None) and seconds is how long the alignment took."""
+    window = threading.Semaphore(max(queueDepth, workers))
+    work = Queue()
+    results = Queue()
+
+    def produce():
+        count = 0
+        try:
+            for item in flanks:
+                window.acquire()
+                work.put((count, item))
+                count += 1
+        except Exception as e:
+            results.put((None, e))
+        else:
+            results.put((None, count))
+
+    def align():
+        while True:
+            task = work.get()
+            if task is None:
+                return
+            index, item = task
+            key, beforeGap, afterGap = item[:3]
+            itemAligner = item[3] if len(item) > 3 else aligner
+            started = time.time()
+            status = 'ok'
+            try:
+                if timeout is None:
+                    size, percentID = itemAligner(beforeGap, afterGap)
+                else:
+                    size, percentID = itemAligner(beforeGap, afterGap,
+                                                  timeout=timeout)
+            except AlignmentTimeout:
+                size = percentID = None
+                status = 'timedOut'
+            except Exception as e:
+                results.put((None, e))
+                return
+            results.put((index, (key, size, percentID,
+                                 time.time() - started, status)))
+
+    producer = threading.Thread(target=produce)
+    aligners = [threading.Thread(target=align) for _ in range(workers)]
+    for thread in [producer] + aligners:
+        thread.daemon = True
+        thread.start()
+
+    # Reorder the results and hand them back in input order
+    pending = {}
+    nextIndex = 0
+    total = None
+    while total is None or nextIndex < total:
+        index, result = results.get()
+        if index is None:
+            if isinstance(result, Exception):
+                raise result
+            total = result
+            continue
+        pending[index] = result
+        while nextIndex in pending:
+            yield pending.pop(nextIndex)
+            nextIndex += 1
+            window.release()
+    for _ in aligners:
+        work.put(None)
+    producer.join()
+    for thread in aligners:
+        thread.join()
+
+
+def findDups(flanks, aligner=alignWithBlat, workers=1, queueDepth=16,
+             timeout=None, slowSeconds=None, onSlow=None):
+    """Generator yielding a Dup for each gap whose flanks overlap by more
+    than 20 bases. flanks is as for alignFlanks, keyed by
+    (header, gapStart, gapEnd), and the alignment options are passed on
+    to it.
+
+    onSlow(key, seconds, status) is called for each gap that timed out or
+    took at least slowSeconds to align."""
+    for (header, gapStart, gapEnd), size, percentID, seconds, status in \
+            alignFlanks(flanks, aligner=aligner, workers=workers,
+                        queueDepth=queueDepth, timeout=timeout):
+        if onSlow is not None and (status != 'ok' or (
+                slowSeconds is not None and seconds >= slowSeconds)):
+            onSlow((header, gapStart, gapEnd), seconds, status)
+        if status == 'ok' and size > 20:
+            yield Dup(header, gapStart, gapEnd, size, percentID)
+
+
+def formatSlow(key, seconds, status):
+    """Formats a line of a slow gap report, without the newline."""
+    header, gapStart, gapEnd = key
+    return "{}\t{}\t{}\t{}\t{:.1f}".format(header, gapStart, gapEnd,
+                                             status, seconds)
+
+
+def formatDup(dup):
+    """Formats a Dup as a line of a .dups file, without the newline."""
+    return "{}\t{}\t{}\t{}\t{:.1f}".format(*dup)
+
+
+def fastaFlanks(fasta, maxSize, maskFilter=None):
+    """Generator yielding ((header, gapStart, gapEnd), beforeGap, afterGap)
+    for every gap in a fasta file (or file handle, read a scaffold at a
+    time) with enough sequence on both sides. Scaffolds are named by the
+    first word of their header, as in indexed genomes. A MaskFilter, if
+    given, decides from the soft-masking which of those gaps to skip or
+    send down the cheap path."""
+    for header, seq in fastaRead(fasta):
+        header = sequenceName(header)
+        for gapStart, gapEnd in findGaps(seq):
+            if not hasFlanks(gapStart, gapEnd, len(seq), maxSize):
+                continue
+            route = 'align'
+            if maskFilter is not None:
+                route = maskFilter.route(stringMaskedBases(seq), gapStart,
+                                         gapEnd, len(seq))
+                if route == 'skip':
+                    continue
+            beforeGap = seq[max(0, gapStart - maxSize):gapStart].upper()
+            afterGap = seq[gapEnd:min(len(seq), gapEnd + maxSize)].upper()
+            yield routedFlanks((header, gapStart, gapEnd), beforeGap,
+                               afterGap, route)
+
+
+def genomeFlanks(genome, maxSize, gapIndex, maskFilter=None):
+    """Like fastaFlanks, but for an indexed genome (a TwoBitFile or
+    IndexedFastaFile): gaps come from its gap sidecar index and only the
+    flanks are fetched, so the whole sequence is never held in memory.
+    The mask filter reads the 2bit mask-block index rather than any
+    sequence."""
+    for header in gapIndex.names():
+        sequence = genome[header]
+        for gapStart, gapEnd in gapIndex.gaps(header):
+            if not hasFlanks(gapStart, gapEnd, len(sequence), maxSize):
+                continue
+            route = 'align'
+            if maskFilter is not None:
+                route = maskFilter.route(sequence.masked_bases, gapStart,
+                                         gapEnd, len(sequence))
+                if route == 'skip':
+                    continue
+            beforeGap = sequence.get_upper_slice(max(0, gapStart - maxSize),
+                                                 gapStart)
+            afterGap = sequence.get_upper_slice(gapEnd, gapEnd + maxSize)
+            yield routedFlanks((header, gapStart, gapEnd), beforeGap,
+                               afterGap, route)
 
 
 def main():
     parser = ArgumentParser(description=__doc__)
-    parser.add_argument('fasta', help='fasta file')
+    parser.add_argument('fasta', help='fasta file (plain or bgzip '
+                        'compressed) or 2bit file, or - to stream fasta '
+                        'from stdin')
+    parser.add_argument('--indexed', action='store_true',
+                        help='read the fasta through a .fai index, fetching '
+                        'only the gap flanks (implied for bgzip and 2bit)')
     parser.add_argument('--maxSize', help='maximum size to attempt to check',
-                        default=5000)
+                        type=int, default=5000)
+    parser.add_argument('--fastPath', action='store_true',
+                        help='call exact and near-exact overlaps without '
+                        'blat (experimental: unlike blat with -repMatch, '
+                        'it also calls overlaps in low-complexity '
+                        'sequence)')
+    parser.add_argument('--workers', help='number of concurrent alignments',
+                        type=int, default=1)
+    parser.add_argument('--queueDepth', type=int, default=16,
+                        help='maximum number of gaps fetched ahead of the '
+                        'alignments')
+    parser.add_argument('--flush', action='store_true',
+                        help='flush each dup as soon as it is found '
+                        '(implied when reading stdin)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='give up on an alignment after this many '
+                        'seconds')
+    parser.add_argument('--slowReport',
+                        help='write gaps that timed out or were slow here')
+    parser.add_argument('--slowSeconds', type=float, default=60,
+                        help='alignments taking this long go in the slow '
+                        'report')
+    addMaskOptions(parser)
     opts = parser.parse_args()
+    streaming = opts.fasta == '-'
+    if streaming and opts.indexed:
+        parser.error('--indexed needs a fasta file, not stdin')
+    flush = opts.flush or streaming
+
+    aligner = alignWithFastPath if opts.fastPath else alignWithBlat
 
     # Print header
-    print('sequence\tgapStart\tgapEnd\tdupSize\tdupPctID')
+    print(DUPS_HEADER)
+    if flush:
+        sys.stdout.flush()
 
-    for header, seq in fastaRead(opts.fasta):
-        for gapStart, gapEnd in findGaps(seq):
-            beforeGap = seq[max(0, gapStart - opts.maxSize):gapStart].upper()
-            afterGap = seq[gapEnd:min(len(seq), gapEnd + opts.maxSize)].upper()
-            if len(beforeGap) < 5 or len(afterGap) < 5:
-                # N at the end/beginning of a sequence, without enough
-                # information on one or both ends to be useful
-                continue
-            size, percentID = alignWithBlat(beforeGap, afterGap)
-            if size > 20:
-                read_info = [header, gapStart, gapEnd, size, percentID]
-                format_str = "{}\t{}\t{}\t{}\t{:.1f}"
-                print(format_str.format(*read_info))
+    maskFilter = maskFilterFor(opts)
+    if streaming:
+        # Gaps are aligned while later scaffolds are still being read
+        flanks = fastaFlanks(sys.stdin, opts.maxSize, maskFilter)
+    elif opts.indexed or opts.fasta.endswith('.2bit') or \
+            isGzip(opts.fasta):
+        genome = openGenome(opts.fasta)
+        flanks = genomeFlanks(genome, opts.maxSize,
+                              openGapIndex(opts.fasta, genome=genome),
+                              maskFilter)
+    else:
+        flanks = fastaFlanks(opts.fasta, opts.maxSize, maskFilter)
+    slowReport = None
+    if opts.slowReport is not None:
+        slowReport = open(opts.slowReport, 'w')
+        slowReport.write(SLOW_HEADER + '\n')
+
+    def onSlow(key, seconds, status):
+        if slowReport is not None:
+            slowReport.write(formatSlow(key, seconds, status) + '\n')
+            if flush:
+                slowReport.flush()
+
+    try:
+        for dup in findDups(flanks, aligner=aligner, workers=opts.workers,
+                            queueDepth=opts.queueDepth, timeout=opts.timeout,
+                            slowSeconds=opts.slowSeconds, onSlow=onSlow):
+            # Dups come out in input order, each as soon as every gap
+            # before it has been aligned
+            print(formatDup(dup))
+            if flush:
+                sys.stdout.flush()
+    finally:
+        if slowReport is not None:
+            slowReport.close()
+    if maskFilter is not None:
+        sys.stderr.write("masked gaps\t" + maskFilter.summary() + '\n')
 
 if __name__ == '__main__':
     main()
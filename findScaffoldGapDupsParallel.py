@@ -2,29 +2,232 @@
 """Find the weird tandem duplications around scaffold gaps and report
 their location and size.
 
-Requires sonLib, jobTree, and the pypi package twobitreader."""
+Requires sonLib, jobTree, and the pypi package twobitreader. Genomes may be
+given as 2bit files or as plain or bgzip-compressed FASTA, which are read
+through a .fai index."""
+import math
+import os
+import resource
+import sys
 from argparse import ArgumentParser
 from collections import namedtuple
-from twobitreader import TwoBitFile
+from indexedFasta import openGenome
+from gapIndex import openGapIndex
+from gapTable import GapTable, collectGaps, writeGapTable
+from decodedGenome import DECODE_CHUNK, openDecodedGenome
 from sonLib.bioio import getTempFile
 from jobTree.scriptTree.target import Target
 from jobTree.scriptTree.stack import Stack
-from findScaffoldGapDups import alignWithBlat, findGaps
+from findScaffoldGapDups import DUPS_HEADER, SLOW_HEADER, addMaskOptions, \
+    alignWithBlat, alignWithFastPath, findDups, formatDup, formatSlow, \
+    maskFilterFor, routedFlanks
 
+if sys.version_info > (3,):
+    xrange = range
 
-Gap = namedtuple('Gap', ['header', 'start', 'end', 'before', 'after'])
+
+# How each alignment job runs its alignments; see findScaffoldGapDups'
+# alignFlanks and MaskFilter. Gaps that time out or take slowSeconds or more
+# are listed in <output>.slow when either timeout or slowSeconds is set.
+# fastPath calls exact overlaps without blat (alignWithFastPath).
+AlignOptions = namedtuple('AlignOptions', ['workers', 'queueDepth',
+                                           'timeout', 'slowSeconds',
+                                           'maskedGaps', 'maskWindow',
+                                           'maskedFraction', 'fastPath'])
+DEFAULT_ALIGN_OPTIONS = AlignOptions(workers=1, queueDepth=16, timeout=None,
+                                     slowSeconds=None, maskedGaps=None,
+                                     maskWindow=1000, maskedFraction=1.0,
+                                     fastPath=False)
+
+# Rough costs used to size jobTree memory requests, in bytes. Each target
+# logs its estimate next to its peak RSS so these can be recalibrated.
+BASE_MEMORY = 150 * 1024 ** 2  # interpreter, modules and slack
+SEQUENCE_INDEX_MEMORY = 2048  # TwoBitSequence object
+# An open 2bit file holds a start and a size, in arrays of up to 8-byte
+# entries, for every N block and soft-masked block of every sequence
+BLOCK_MEMORY = 16
+GAP_MEMORY = 64  # one gap's entries in a GapArrays or gap table, and slack
+FLANK_MEMORY_PER_BASE = 4  # a fetched flank plus the blat input copy
+BLAT_MEMORY = 64 * 1024 ** 2  # one blat process on a pair of flanks
+# Decoded 2bit blocks kept by AlignAndCompare. Gaps are read in order, so
+# the only reuse is between the flanks of neighbouring gaps, and the cache
+# only needs the blocks under about two flank windows.
+CACHE_BLOCK_BASES = 16384
+MIN_MEMORY = 256 * 1024 ** 2
+# Decoding one chunk of a scaffold into the decoded genome file
+DECODE_MEMORY_PER_BASE = 8
+# Decoding and checksumming one base, and a floor for small genomes
+DECODE_SECONDS_PER_BASE = 1e-7
+MIN_DECODE_SECONDS = 60
+# Building a gap index, per byte of the assembly file: an open 2bit file's
+# block arrays and the gap lists made from them (block tables are a small
+# part of a 2bit, and a FASTA has none), and the time to checksum and scan
+# it, with a floor for small genomes
+INDEX_MEMORY_PER_BYTE = 0.25
+INDEX_SECONDS_PER_BYTE = 2e-8
+MIN_INDEX_SECONDS = 60
+
+# Cost of starting one alignment, in flank bases, used to balance batches
+ALIGN_OVERHEAD = 2000
+
+
+def scanMemory(sequenceSizes, gapCount):
+    """Estimates the memory needed to collect the gaps of a 2bit file from
+    its gap index, given its sequence sizes and total number of gaps."""
+    memory = BASE_MEMORY + SEQUENCE_INDEX_MEMORY * len(sequenceSizes) + \
+        GAP_MEMORY * gapCount
+    return max(MIN_MEMORY, int(memory))
+
+
+def batchFlankSize(gaps, start, end):
+    """The largest total flank size of gaps [start, end) of a GapArrays."""
+    return max([gaps.flankSize(i) for i in xrange(start, end)] or [0])
+
+
+def cacheBytes(flankSize):
+    """Block cache size for a batch whose largest flanks total flankSize
+    bases: enough for one gap's flanks and the next's, plus a partly used
+    block at each end of them."""
+    return flankSize + 4 * CACHE_BLOCK_BASES
+
+
+def indexMemory(fileSize):
+    """Estimates the memory needed to build the gap index of an assembly
+    file of fileSize bytes."""
+    return max(MIN_MEMORY, int(BASE_MEMORY + INDEX_MEMORY_PER_BYTE * fileSize))
+
+
+def indexSeconds(fileSize):
+    """Estimates the time needed to build the gap index of an assembly."""
+    return max(MIN_INDEX_SECONDS, int(INDEX_SECONDS_PER_BYTE * fileSize))
+
+
+def decodeMemory(sequenceSizes):
+    """Estimates the memory needed to decode a genome with the given
+    sequence sizes, which is done a chunk of a scaffold at a time."""
+    chunk = min(DECODE_CHUNK, max(list(sequenceSizes.values()) or [0]))
+    memory = BASE_MEMORY + SEQUENCE_INDEX_MEMORY * len(sequenceSizes) + \
+        DECODE_MEMORY_PER_BASE * chunk
+    return max(MIN_MEMORY, int(memory))
+
+
+def decodeSeconds(sequenceSizes):
+    """Estimates the time needed to decode a genome."""
+    return max(MIN_DECODE_SECONDS,
+               int(DECODE_SECONDS_PER_BASE * sum(sequenceSizes.values())))
+
+
+def alignMemory(sequenceCount, gaps, start, end, alignOptions,
+                decoded=False, blockCount=0):
+    """Estimates the memory needed to align gaps [start, end) of the
+    GapArrays of a 2bit file with sequenceCount sequences and blockCount N
+    and soft-masked blocks in all (see genomeBlocks). Decoded runs read a
+    shared mapped genome and keep no block cache, and only open the 2bit
+    file, with its blocks, to filter masked gaps."""
+    flankSize = batchFlankSize(gaps, start, end)
+    inFlight = max(alignOptions.queueDepth, alignOptions.workers)
+    memory = BASE_MEMORY + SEQUENCE_INDEX_MEMORY * sequenceCount + \
+        GAP_MEMORY * (end - start) + \
+        FLANK_MEMORY_PER_BASE * flankSize * inFlight + \
+        BLAT_MEMORY * alignOptions.workers
+    if not decoded:
+        memory += cacheBytes(flankSize)
+    if not decoded or alignOptions.maskedGaps is not None:
+        memory += BLOCK_MEMORY * blockCount
+    return max(MIN_MEMORY, int(memory))
+
+
+def genomeBlocks(index):
+    """The number of N and soft-masked blocks an open genome holds, from
+    its GapIndex. Each gap is at least one N block."""
+    return index.gapCount() + index.maskBlockCount()
+
+
+def peakMemory(who=resource.RUSAGE_SELF):
+    """Returns the peak resident set size in bytes of this process, or with
+    RUSAGE_CHILDREN, of the largest of its finished child processes."""
+    maxrss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+def logMemory(target, name, estimate):
+    """Records a target's memory estimate next to its actual peak RSS and
+    that of its largest blat process, which the estimate budgets for
+    separately (BLAT_MEMORY per worker)."""
+    target.logToMaster("memory\t{}\t{}\testimated={}\tpeakRSS={}"
+                       "\tchildPeakRSS={}".format(
+                           target.__class__.__name__, name, estimate,
+                           peakMemory(),
+                           peakMemory(resource.RUSAGE_CHILDREN)))
+
+
+def gapCost(gaps, i):
+    """Estimated cost of aligning the flanks of gap i of a GapArrays."""
+    return ALIGN_OVERHEAD + gaps.flankSize(i)
+
+
+def batchGaps(gaps, split):
+    """Splits a GapArrays into runs of at most split gaps that cost about
+    the same. The budget of a run is the total cost over the number of
+    runs of split gaps. Each run gets an even share of the cost left
+    between the runs still needed: enough for the gaps left at split gaps
+    per run, and for their cost at the budget per run (less one average
+    gap, so rounding does not add a run of one gap). So runs of large gaps
+    are shorter than runs of small ones. Yields the (start, end) gap
+    numbers of each run."""
+    count = len(gaps)
+    if count == 0:
+        return
+    remaining = sum(gapCost(gaps, i) for i in xrange(count))
+    budget = remaining / float((count + split - 1) // split)
+    average = remaining / float(count)
+    start = 0
+    while start < count:
+        runs = max((count - start + split - 1) // split,
+                   int(math.ceil((remaining - average) / budget)))
+        share = remaining / float(runs)
+        end = start
+        cost = 0
+        while end < count and end - start < split and \
+                (end == start or cost + gapCost(gaps, end) <= share):
+            cost += gapCost(gaps, end)
+            end += 1
+        yield start, end
+        remaining -= cost
+        start = end
+
+
+def interleave(lists):
+    """Round-robins the items of several lists into one list."""
+    merged = []
+    for i in xrange(max([len(items) for items in lists] or [0])):
+        merged.extend(items[i] for items in lists if i < len(items))
+    return merged
+
+
+def reportsSlow(alignOptions):
+    return alignOptions.timeout is not None or \
+        alignOptions.slowSeconds is not None
+
+
+def slowPath(output):
+    return output + '.slow'
 
 
 class Concatenate(Target):
-    def __init__(self, inputs, output):
+    def __init__(self, inputs, output, header=DUPS_HEADER):
         Target.__init__(self)
         self.inputs = inputs
         self.output = output
+        self.header = header
 
     def run(self):
         with open(self.output, 'w') as outfile:
             # Print header
-            outfile.write('sequence\tgapStart\tgapEnd\tdupSize\tdupPctID\n')
+            outfile.write(self.header + '\n')
             for input in self.inputs:
                 with open(input) as infile:
                     for line in infile:
@@ -32,87 +235,378 @@ class Concatenate(Target):
 
 
 class AlignAndCompare(Target):
-    def __init__(self, twoBit, gaps, output):
-        Target.__init__(self, memory=2000000000)
+    """Aligns the flanks of gaps [start, end) of a gap table file. Only the
+    file name and range are pickled with the target."""
+    def __init__(self, twoBit, gapTable, start, end, output,
+                 alignOptions=DEFAULT_ALIGN_OPTIONS, memory=2000000000,
+                 decoded=False, cacheBytes=0, sidecarDirectory=None):
+        Target.__init__(self, memory=memory, cpu=alignOptions.workers)
+        self.memory = memory
         self.twoBit = twoBit
-        self.gaps = gaps
+        self.gapTable = gapTable
+        self.start = start
+        self.end = end
         self.output = output
+        self.alignOptions = alignOptions
+        self.decoded = decoded
+        self.cacheBytes = cacheBytes
+        self.sidecarDirectory = sidecarDirectory
+
+    def flanks(self, genome, maskFilter=None, maskGenome=None):
+        """Generator yielding ((header, start, end), beforeGap, afterGap)
+        for each gap. Gaps are checked against maskFilter using the soft
+        mask of maskGenome, since a decoded genome has none."""
+        gapTable = GapTable(self.gapTable)
+        for gap in gapTable.gaps(self.start, self.end):
+            route = 'align'
+            if maskFilter is not None:
+                masked = maskGenome[gap.header]
+                route = maskFilter.route(masked.masked_bases, gap.start,
+                                         gap.end, len(masked))
+                if route == 'skip':
+                    continue
+            sequence = genome[gap.header]
+            seq1 = sequence.get_upper_slice(gap.before, gap.start)
+            seq2 = sequence.get_upper_slice(gap.end, gap.after)
+            yield routedFlanks((gap.header, gap.start, gap.end), seq1, seq2,
+                               route)
+        gapTable.close()
 
     def run(self):
-        genome = TwoBitFile(self.twoBit)
+        if self.decoded:
+            # Built by DecodeGenome and shared by all jobs; never rebuilt
+            # here, since every job would then decode its own copy
+            genome = openDecodedGenome(self.twoBit,
+                                       directory=self.sidecarDirectory,
+                                       build=False)
+        else:
+            # Every batch of a genome reopens it, so keep its 2bit index
+            genome = openGenome(self.twoBit, cacheBytes=self.cacheBytes,
+                                offsetIndex=True)
+        options = self.alignOptions
+        maskFilter = maskFilterFor(options)
+        maskGenome = None
+        if maskFilter is not None:
+            maskGenome = openGenome(self.twoBit) if self.decoded else genome
+        aligner = alignWithFastPath if options.fastPath else alignWithBlat
+        slowLines = []
+
+        def onSlow(key, seconds, status):
+            slowLines.append(formatSlow(key, seconds, status) + '\n')
+
         with open(self.output, 'w') as outfile:
-            for gap in self.gaps:
-                print(gap)
-                print(repr(genome[gap.header][gap.before:gap.start].upper()))
-                print(repr(genome[gap.header][gap.end:gap.after].upper()))
-                seq1 = genome[gap.header][gap.before:gap.start].upper()
-                seq2 = genome[gap.header][gap.end:gap.after].upper()
-                size, percentID = alignWithBlat(seq1, seq2)
-                if size > 20:
-                    read_info = [gap.header, gap.start, gap.end, size, percentID]
-                    format_str = "{}\t{}\t{}\t{}\t{:.1f}\n"
-                    outfile.write(format_str.format(*read_info))
+            for dup in findDups(self.flanks(genome, maskFilter, maskGenome),
+                                aligner=aligner, workers=options.workers,
+                                queueDepth=options.queueDepth,
+                                timeout=options.timeout,
+                                slowSeconds=options.slowSeconds,
+                                onSlow=onSlow):
+                outfile.write(formatDup(dup) + '\n')
+        if reportsSlow(options):
+            with open(slowPath(self.output), 'w') as slowfile:
+                slowfile.writelines(slowLines)
+            self.logToMaster("slow\t{}\t{}".format(self.twoBit,
+                                                    len(slowLines)))
+        if maskFilter is not None:
+            self.logToMaster("masked gaps\t{}\t{}".format(
+                self.twoBit, maskFilter.summary()))
+        if getattr(genome, 'cache', None) is not None:
+            self.logToMaster("cache\t{}\t{}".format(self.twoBit,
+                                                    genome.cache.stats()))
+        logMemory(self, self.twoBit, self.memory)
+
+
+def alignBatch(twoBit, gapTable, gaps, start, end, output, alignOptions,
+               decoded, blockCount, sidecarDirectory):
+    """Returns the AlignAndCompare target for gaps [start, end) of the
+    GapArrays written to gapTable, sized for those gaps and for the
+    blockCount blocks of the genome. A decoded genome is looked for beside
+    the genome or in sidecarDirectory."""
+    memory = alignMemory(len(gaps.names), gaps, start, end, alignOptions,
+                         decoded, blockCount)
+    cache = 0 if decoded else cacheBytes(batchFlankSize(gaps, start, end))
+    return AlignAndCompare(twoBit, gapTable, start, end, output,
+                           alignOptions, memory, decoded, cache,
+                           sidecarDirectory)
 
 
 class FindScaffoldGapsForTwoBit(Target):
-    def __init__(self, twoBit, output, maxSize, split):
-        Target.__init__(self, memory=4000000000)
+    """Schedules the gap search of one genome, whose gap index IndexGenome
+    has built beside it or in sidecarDirectory."""
+    def __init__(self, twoBit, output, maxSize, split,
+                 alignOptions=DEFAULT_ALIGN_OPTIONS, memory=4000000000,
+                 decoded=False, sidecarDirectory=None):
+        Target.__init__(self, memory=memory)
+        self.memory = memory
         self.twoBit = twoBit
         self.output = output
         self.maxSize = maxSize
         self.split = split
+        self.alignOptions = alignOptions
+        self.decoded = decoded
+        self.sidecarDirectory = sidecarDirectory
 
     def run(self):
-        gaps = []
-        for header, sequence in TwoBitFile(self.twoBit).iteritems():
-            for gapStart, gapEnd in findGaps(str(sequence)):
-                beforeGap = max(0, gapStart - self.maxSize)
-                afterGap = min(len(sequence), gapEnd + self.maxSize)
-                if gapStart - beforeGap > 5 and afterGap - gapEnd > 5:
-                    gaps.append(Gap(header=header, start=gapStart, end=gapEnd,
-                                    before=beforeGap, after=afterGap))
+        index = openGapIndex(self.twoBit, directory=self.sidecarDirectory,
+                             build=False)
+        gaps = collectGaps(self.twoBit, self.maxSize, index)
+        blockCount = genomeBlocks(index)
+        index.close()
+        gapTable = getTempFile(rootDir=self.getGlobalTempDir())
+        writeGapTable(gapTable, gaps)
 
         outputs = []
-        for i in xrange(0, len(gaps), self.maxSize):
-            for gapList in [gaps[i:i + self.maxSize]]:
+        for start, end in batchGaps(gaps, self.split):
+            output = getTempFile(rootDir=self.getGlobalTempDir())
+            self.addChildTarget(alignBatch(self.twoBit, gapTable, gaps,
+                                           start, end, output,
+                                           self.alignOptions, self.decoded,
+                                           blockCount,
+                                           self.sidecarDirectory))
+            outputs.append(output)
+
+        self.setFollowOnTarget(ConcatenateAll(
+            concatenations([self.output], [outputs], self.alignOptions)))
+        logMemory(self, self.twoBit, self.memory)
+
+
+def concatenations(outputs, inputsByGenome, alignOptions):
+    """Returns (output, inputs, header) for each file ConcatenateAll should
+    write: every genome's dups, and its slow report if there is one."""
+    jobs = []
+    for output, inputs in zip(outputs, inputsByGenome):
+        jobs.append((output, inputs, DUPS_HEADER))
+        if reportsSlow(alignOptions):
+            jobs.append((slowPath(output), [slowPath(input)
+                                            for input in inputs],
+                         SLOW_HEADER))
+    return jobs
+
+
+class ConcatenateAll(Target):
+    """Concatenates the batch outputs of several genomes, each into its own
+    output file."""
+    def __init__(self, jobs):
+        Target.__init__(self)
+        self.jobs = jobs
+
+    def run(self):
+        for output, inputs, header in self.jobs:
+            self.addChildTarget(Concatenate(inputs, output, header))
+
+
+class FindScaffoldGapsGlobally(Target):
+    """Schedules the gaps of all genomes as one work list: every genome's
+    gaps are cut into cost-balanced batches and the batches of different
+    genomes are interleaved, so large and small genomes finish together.
+    Results are demultiplexed back into one output per genome."""
+    def __init__(self, twoBits, outputs, maxSize, split,
+                 alignOptions=DEFAULT_ALIGN_OPTIONS, memory=4000000000,
+                 decoded=False, sidecarDirectory=None):
+        Target.__init__(self, memory=memory)
+        self.memory = memory
+        self.twoBits = twoBits
+        self.outputs = outputs
+        self.maxSize = maxSize
+        self.split = split
+        self.alignOptions = alignOptions
+        self.decoded = decoded
+        self.sidecarDirectory = sidecarDirectory
+
+    def run(self):
+        batchesByGenome = []
+        outputsByGenome = []
+        for twoBit in self.twoBits:
+            index = openGapIndex(twoBit, directory=self.sidecarDirectory,
+                                 build=False)
+            gaps = collectGaps(twoBit, self.maxSize, index)
+            blockCount = genomeBlocks(index)
+            index.close()
+            gapTable = getTempFile(rootDir=self.getGlobalTempDir())
+            writeGapTable(gapTable, gaps)
+            batches = []
+            outputs = []
+            for start, end in batchGaps(gaps, self.split):
                 output = getTempFile(rootDir=self.getGlobalTempDir())
-                align = AlignAndCompare(self.twoBit, gapList, output)
-                self.addChildTarget(align)
+                batches.append(alignBatch(twoBit, gapTable, gaps, start, end,
+                                          output, self.alignOptions,
+                                          self.decoded, blockCount,
+                                          self.sidecarDirectory))
                 outputs.append(output)
+            batchesByGenome.append(batches)
+            outputsByGenome.append(outputs)
+
+        for align in interleave(batchesByGenome):
+            self.addChildTarget(align)
+
+        self.setFollowOnTarget(ConcatenateAll(
+            concatenations(self.outputs, outputsByGenome,
+                           self.alignOptions)))
+        logMemory(self, ','.join(self.twoBits), self.memory)
 
-        self.setFollowOnTarget(Concatenate(outputs, self.output))
+
+class IndexGenome(Target):
+    """Builds (or checks) the gap index of a genome, beside it or in
+    sidecarDirectory, along with the genome's own .fai or 2bit offset
+    index. For a decoded run, then decodes the genome in a follow-on sized
+    from the index."""
+    def __init__(self, twoBit, sidecarDirectory, decoded=False,
+                 memory=MIN_MEMORY, time=MIN_INDEX_SECONDS):
+        Target.__init__(self, memory=memory, time=time)
+        self.memory = memory
+        self.twoBit = twoBit
+        self.sidecarDirectory = sidecarDirectory
+        self.decoded = decoded
+
+    def run(self):
+        genome = openGenome(self.twoBit, offsetIndex=True)
+        index = openGapIndex(self.twoBit, genome,
+                             directory=self.sidecarDirectory)
+        self.logToMaster("gap index\t{}\t{}".format(self.twoBit, index.path))
+        if self.decoded:
+            sizes = index.sequence_sizes()
+            self.setFollowOnTarget(DecodeGenome(self.twoBit,
+                                                self.sidecarDirectory,
+                                                decodeMemory(sizes),
+                                                decodeSeconds(sizes)))
+        index.close()
+        logMemory(self, self.twoBit, self.memory)
+
+
+class DecodeGenome(Target):
+    """Builds (or checks) the decoded copy of a genome that the alignment
+    jobs of a decoded run map, beside it or in sidecarDirectory."""
+    def __init__(self, twoBit, sidecarDirectory, memory=MIN_MEMORY,
+                 time=MIN_DECODE_SECONDS):
+        Target.__init__(self, memory=memory, time=time)
+        self.memory = memory
+        self.twoBit = twoBit
+        self.sidecarDirectory = sidecarDirectory
+
+    def run(self):
+        genome = openDecodedGenome(self.twoBit,
+                                   directory=self.sidecarDirectory)
+        self.logToMaster("decoded\t{}\t{}".format(self.twoBit, genome.path))
+        logMemory(self, self.twoBit, self.memory)
 
 
 class FindScaffoldGapsForAllTwoBits(Target):
-    def __init__(self, twoBits, outputs, maxSize, split):
+    """Builds the gap index of every genome (and for a decoded run, its
+    decoded copy) in its own job, then schedules the searches. Indexes and
+    decoded copies of genomes in read-only directories go in a directory
+    shared by every job of the run."""
+    def __init__(self, twoBits, outputs, maxSize, split,
+                 alignOptions=DEFAULT_ALIGN_OPTIONS, globalSchedule=False,
+                 decoded=False):
         Target.__init__(self)
         self.twoBits = twoBits
         self.outputs = outputs
         self.maxSize = maxSize
         self.split = split
+        self.alignOptions = alignOptions
+        self.globalSchedule = globalSchedule
+        self.decoded = decoded
 
     def run(self):
-        for twoBit, output in zip(self.twoBits, self.outputs):
+        sidecarDirectory = self.getGlobalTempDir()
+        for twoBit in self.twoBits:
+            size = os.path.getsize(twoBit)
+            self.addChildTarget(IndexGenome(twoBit, sidecarDirectory,
+                                            self.decoded, indexMemory(size),
+                                            indexSeconds(size)))
+        self.setFollowOnTarget(ScheduleScaffoldGaps(
+            self.twoBits, self.outputs, self.maxSize, self.split,
+            self.alignOptions, self.globalSchedule, self.decoded,
+            sidecarDirectory))
+
+
+class ScheduleScaffoldGaps(Target):
+    """Schedules the gap search of each genome, or of all of them together
+    with globalSchedule. Only maps the gap indexes IndexGenome built."""
+    def __init__(self, twoBits, outputs, maxSize, split,
+                 alignOptions=DEFAULT_ALIGN_OPTIONS, globalSchedule=False,
+                 decoded=False, sidecarDirectory=None):
+        Target.__init__(self)
+        self.twoBits = twoBits
+        self.outputs = outputs
+        self.maxSize = maxSize
+        self.split = split
+        self.alignOptions = alignOptions
+        self.globalSchedule = globalSchedule
+        self.decoded = decoded
+        self.sidecarDirectory = sidecarDirectory
+
+    def run(self):
+        indexes = [openGapIndex(twoBit, directory=self.sidecarDirectory,
+                                build=False)
+                   for twoBit in self.twoBits]
+        if self.globalSchedule:
+            sizes = {}
+            for twoBit, index in zip(self.twoBits, indexes):
+                for name, size in index.sequence_sizes().items():
+                    sizes[(twoBit, name)] = size
+            memory = scanMemory(sizes, sum(index.gapCount()
+                                           for index in indexes))
+            self.addChildTarget(FindScaffoldGapsGlobally(
+                self.twoBits, self.outputs, self.maxSize, self.split,
+                self.alignOptions, memory, self.decoded,
+                self.sidecarDirectory))
+            return
+        for twoBit, output, index in zip(self.twoBits, self.outputs, indexes):
+            memory = scanMemory(index.sequence_sizes(), index.gapCount())
             find = FindScaffoldGapsForTwoBit(twoBit, output, self.maxSize,
-                                             self.split)
+                                             self.split, self.alignOptions,
+                                             memory, self.decoded,
+                                             self.sidecarDirectory)
             self.addChildTarget(find)
 
 
 def main():
     parser = ArgumentParser(description=__doc__)
-    parser.add_argument('--twoBits', help='2bit files', required=True,
-                        nargs='+')
+    parser.add_argument('--twoBits', help='2bit or indexed fasta files',
+                        required=True, nargs='+')
     parser.add_argument('--outputs', help='output files', required=True,
                         nargs='+')
     parser.add_argument('--maxSize', help='maximum size to attempt to check',
                         type=int, default=5000)
     parser.add_argument('--split', help='Allow this many checks per job',
                         type=int, default=1000)
+    parser.add_argument('--workers', help='concurrent alignments per job',
+                        type=int, default=1)
+    parser.add_argument('--queueDepth', type=int, default=16,
+                        help='maximum number of gaps fetched ahead of the '
+                        'alignments in each job')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='give up on an alignment after this many '
+                        'seconds')
+    parser.add_argument('--slowSeconds', type=float, default=None,
+                        help='report alignments taking this long in '
+                        '<output>.slow, along with any that timed out')
+    parser.add_argument('--fastPath', action='store_true',
+                        help='call exact and near-exact overlaps without '
+                        'blat (experimental)')
+    addMaskOptions(parser)
+    parser.add_argument('--globalSchedule', action='store_true',
+                        help='balance the gaps of all genomes as one work '
+                        'list instead of scheduling each genome separately')
+    parser.add_argument('--decoded', action='store_true',
+                        help='decode each genome once into a memory-mapped '
+                        'file shared by all alignment jobs on a node')
     Stack.addJobTreeOptions(parser)
     opts = parser.parse_args()
 
+    alignOptions = AlignOptions(workers=opts.workers,
+                                queueDepth=opts.queueDepth,
+                                timeout=opts.timeout,
+                                slowSeconds=opts.slowSeconds,
+                                maskedGaps=opts.maskedGaps,
+                                maskWindow=opts.maskWindow,
+                                maskedFraction=opts.maskedFraction,
+                                fastPath=opts.fastPath)
     finds = FindScaffoldGapsForAllTwoBits(opts.twoBits, opts.outputs,
-                                          opts.maxSize, opts.split)
+                                          opts.maxSize, opts.split,
+                                          alignOptions, opts.globalSchedule,
+                                          opts.decoded)
     Stack(finds).startJobTree(opts)
 
 
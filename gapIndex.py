@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+"""Persistent sidecar index of the scaffold gaps in an assembly.
+
+The first time an assembly is scanned, its scaffold lengths and
+soft-masked block counts (in assembly order) and sorted gap start/end
+arrays are written beside it as <assembly>.gaps (see sidecar), along with
+an MD5 checksum of the assembly file. Later runs memory-map the sidecar and
+read only the scaffolds they need, skipping the gap scan. A sidecar whose checksum no longer matches the
+assembly is rebuilt automatically.
+
+Run as a script to build (or refresh) the sidecar for some assemblies.
+"""
+import struct
+from argparse import ArgumentParser
+from collections import namedtuple
+from indexedFasta import openGenome
+from sidecar import HEADER, Sidecar, cachePath, openSidecar, packHeader, \
+    writeAtomically
+
+MAGIC = b'GAPIDX3\0'
+# name length (name follows), scaffold length, gap count, mask block count,
+# offset of arrays
+ENTRY = struct.Struct('<HQQQQ')
+SUFFIX = '.gaps'
+
+ScaffoldGaps = namedtuple('ScaffoldGaps', ['length', 'count', 'maskBlocks',
+                                           'offset'])
+
+
+def sidecarPath(assembly):
+    return assembly + SUFFIX
+
+
+def writeGapIndex(path, assembly, genome=None):
+    """Scans an assembly for gaps and writes the sidecar index to path."""
+    if genome is None:
+        genome = openGenome(assembly)
+    names = genome.sequence_names()
+    gaps = [list(genome[name].n_blocks()) for name in names]
+    encodedNames = [name.encode('ascii') for name in names]
+    header = packHeader(MAGIC, assembly, len(names))
+
+    def write(f):
+        f.write(header)
+        offset = HEADER.size + sum(ENTRY.size + len(name)
+                                   for name in encodedNames)
+        for name, encoded, scaffoldGaps in zip(names, encodedNames, gaps):
+            sequence = genome[name]
+            f.write(ENTRY.pack(len(encoded), len(sequence),
+                               len(scaffoldGaps),
+                               sequence.mask_block_count(), offset))
+            f.write(encoded)
+            offset += 16 * len(scaffoldGaps)
+        for scaffoldGaps in gaps:
+            count = len(scaffoldGaps)
+            f.write(struct.pack('<%dQ' % count,
+                                *[start for start, _ in scaffoldGaps]))
+            f.write(struct.pack('<%dQ' % count,
+                                *[end for _, end in scaffoldGaps]))
+
+    writeAtomically(path, write)
+
+
+class GapIndex(Sidecar):
+    """A memory-mapped gap sidecar. Gaps are read per scaffold on demand.
+    """
+    MAGIC = MAGIC
+    KIND = 'gap index'
+
+    def __init__(self, path):
+        count = self.mapSidecar(path)
+        self._scaffolds = {}
+        self._names = []
+        position = HEADER.size
+        for _ in range(count):
+            nameLength, length, gapCount, maskBlocks, offset = \
+                ENTRY.unpack_from(self._map, position)
+            position += ENTRY.size
+            name = self._map[position:position + nameLength].decode('ascii')
+            name = str(name)
+            position += nameLength
+            self._names.append(name)
+            self._scaffolds[name] = ScaffoldGaps(length, gapCount,
+                                                 maskBlocks, offset)
+
+    def names(self):
+        """Returns the scaffold names in the order of the assembly."""
+        return list(self._names)
+
+    def sequence_sizes(self):
+        """returns a dictionary with the sizes of each sequence"""
+        return dict((name, scaffold.length)
+                    for name, scaffold in self._scaffolds.items())
+
+    def gapCount(self, name=None):
+        """Returns the number of gaps in one scaffold, or in all of them."""
+        if name is not None:
+            return self._scaffolds[name].count
+        return sum(scaffold.count for scaffold in self._scaffolds.values())
+
+    def maskBlockCount(self, name=None):
+        """Returns the number of soft-masked blocks a 2bit file holds for
+        one scaffold, or for all of them."""
+        if name is not None:
+            return self._scaffolds[name].maskBlocks
+        return sum(scaffold.maskBlocks
+                   for scaffold in self._scaffolds.values())
+
+    def starts(self, name):
+        scaffold = self._scaffolds[name]
+        return struct.unpack_from('<%dQ' % scaffold.count, self._map,
+                                  scaffold.offset)
+
+    def ends(self, name):
+        scaffold = self._scaffolds[name]
+        return struct.unpack_from('<%dQ' % scaffold.count, self._map,
+                                  scaffold.offset + 8 * scaffold.count)
+
+    def gaps(self, name):
+        """Returns a list of (start, end) for each gap in a scaffold."""
+        return list(zip(self.starts(name), self.ends(name)))
+
+
+def openGapIndex(assembly, genome=None, directory=None, build=True):
+    """Returns the GapIndex for an assembly, building or rebuilding the
+    sidecar first if it is missing or stale. Assemblies in read-only
+    directories are indexed into directory, by default the temporary
+    directory. Without build, raises ValueError instead of building."""
+    paths = [sidecarPath(assembly), cachePath(assembly, SUFFIX, directory)]
+    return openSidecar(assembly, paths, GapIndex,
+                       lambda candidate: writeGapIndex(candidate, assembly,
+                                                       genome),
+                       build)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('assemblies', nargs='+',
+                        help='2bit or (bgzip) fasta assemblies')
+    opts = parser.parse_args()
+
+    for assembly in opts.assemblies:
+        index = openGapIndex(assembly)
+        print("{}\t{}\t{}".format(index.path, len(index.names()),
+                                  index.gapCount()))
+
+
+if __name__ == '__main__':
+    main()
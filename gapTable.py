@@ -0,0 +1,145 @@
+#!/usr/bin/env python2
+"""Compact, memory-mappable table of the gaps a parallel run will align.
+
+Gaps are held as parallel typed arrays (a scaffold ID into a table of
+scaffold names, and the gap start and end and the flank window around it)
+rather than as one Python object per gap. The table is written once per
+assembly to a file the alignment jobs memory-map, so each job is handed only
+the file and a range of gap numbers, and reads just that range.
+"""
+import mmap
+import struct
+from array import array
+from collections import namedtuple
+from gapIndex import openGapIndex
+
+Gap = namedtuple('Gap', ['header', 'start', 'end', 'before', 'after'])
+
+MAGIC = b'GAPTBL1\0'
+# magic, scaffold count, gap count
+HEADER = struct.Struct('<8sQQ')
+# name length (name follows)
+NAME = struct.Struct('<H')
+# the arrays follow the names, each gap count entries long
+COLUMNS = ['scaffolds', 'starts', 'ends', 'befores', 'afters']
+# entries packed per struct call when writing
+WRITE_CHUNK = 1 << 16
+
+
+def positionTypecode():
+    """Returns an unsigned array typecode of at least 8 bytes for gap
+    positions: 'L' is only 4 bytes on some platforms, and Python 2 has no
+    'Q'."""
+    for typecode in ('L', 'Q'):
+        try:
+            if array(typecode).itemsize >= 8:
+                return typecode
+        except ValueError:
+            continue
+    raise ImportError('No 8-byte array type to hold gap positions')
+
+
+POSITION = positionTypecode()
+
+
+class GapArrays(object):
+    """Gaps held as parallel arrays, with gap i in scaffold
+    names[scaffolds[i]]."""
+
+    def __init__(self, names):
+        self.names = names
+        self.scaffolds = array('L')  # at least 4 bytes
+        self.starts = array(POSITION)
+        self.ends = array(POSITION)
+        self.befores = array(POSITION)
+        self.afters = array(POSITION)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, scaffold, start, end, before, after):
+        self.scaffolds.append(scaffold)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.befores.append(before)
+        self.afters.append(after)
+
+    def flankSize(self, i):
+        """Total size of the flanks of gap i."""
+        return (self.starts[i] - self.befores[i]) + \
+            (self.afters[i] - self.ends[i])
+
+
+def collectGaps(assembly, maxSize, index=None):
+    """Returns the GapArrays of every gap in an assembly that has more than
+    5 bases on both sides, with flank windows of up to maxSize bases. index
+    is the assembly's GapIndex, opened (and built if need be) if not
+    given."""
+    if index is None:
+        index = openGapIndex(assembly)
+    names = index.names()
+    sizes = index.sequence_sizes()
+    gaps = GapArrays(names)
+    for scaffold, header in enumerate(names):
+        for gapStart, gapEnd in index.gaps(header):
+            beforeGap = max(0, gapStart - maxSize)
+            afterGap = min(sizes[header], gapEnd + maxSize)
+            if gapStart - beforeGap > 5 and afterGap - gapEnd > 5:
+                gaps.append(scaffold, gapStart, gapEnd, beforeGap, afterGap)
+    return gaps
+
+
+def writeGapTable(path, gaps):
+    """Writes GapArrays to a gap table file."""
+    encodedNames = [name.encode('ascii') for name in gaps.names]
+    count = len(gaps)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(encodedNames), count))
+        for name in encodedNames:
+            f.write(NAME.pack(len(name)))
+            f.write(name)
+        for column in COLUMNS:
+            values = getattr(gaps, column)
+            for start in range(0, count, WRITE_CHUNK):
+                chunk = values[start:start + WRITE_CHUNK]
+                f.write(struct.pack('<%dQ' % len(chunk), *chunk))
+
+
+class GapTable(object):
+    """A memory-mapped gap table. Gaps are read by number on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, scaffoldCount, self._count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a gap table' % path)
+        self.names = []
+        position = HEADER.size
+        for _ in range(scaffoldCount):
+            nameLength, = NAME.unpack_from(self._map, position)
+            position += NAME.size
+            name = self._map[position:position + nameLength].decode('ascii')
+            self.names.append(str(name))
+            position += nameLength
+        self._columns = dict((column, position + 8 * self._count * i)
+                             for i, column in enumerate(COLUMNS))
+
+    def __len__(self):
+        return self._count
+
+    def column(self, column, start, end):
+        """Returns the values of one column for gaps [start, end)."""
+        return struct.unpack_from('<%dQ' % (end - start), self._map,
+                                  self._columns[column] + 8 * start)
+
+    def gaps(self, start, end):
+        """Generator yielding a Gap for each of gaps [start, end)."""
+        columns = [self.column(column, start, end) for column in COLUMNS]
+        for scaffold, gapStart, gapEnd, before, after in zip(*columns):
+            yield Gap(header=self.names[scaffold], start=gapStart, end=gapEnd,
+                      before=before, after=after)
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python2
+"""Random access to FASTA files through a samtools-style .fai index.
+
+IndexedFastaFile mirrors twobitreader.TwoBitFile: it is a dict of
+IndexedFastaSequence objects that support the same slicing interface as
+TwoBitSequence (get_slice, get_upper_slice, masked_bases, n_blocks, len and
+str), so the gap finders can fetch flanks by offset without loading the
+whole genome.
+
+Plain and BGZF-compressed (bgzip) FASTA are supported. A missing .fai (and,
+for BGZF, .gzi) index is built beside the FASTA on first use.
+"""
+import os
+import re
+import struct
+import zlib
+from bisect import bisect_right
+from collections import namedtuple
+from nRuns import nRunsInChunks
+
+SOFT_MASKED = re.compile(b'[a-z]+')
+
+FaiEntry = namedtuple('FaiEntry', ['name', 'length', 'offset', 'lineBases',
+                                   'lineWidth'])
+
+
+class IndexedFastaError(Exception):
+    pass
+
+
+def isBgzf(path):
+    """Returns True if the file starts with a BGZF block header."""
+    with open(path, 'rb') as f:
+        header = f.read(16)
+    return len(header) == 16 and header[:4] == b'\x1f\x8b\x08\x04' and \
+        header[12:14] == b'BC'
+
+
+def isGzip(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+class BgzfReader(object):
+    """Random access to the uncompressed bytes of a BGZF file.
+
+    Block offsets come from a .gzi index (as written by bgzip -i), which is
+    built from the block headers and trailers alone if it does not exist."""
+
+    def __init__(self, path, gziPath=None):
+        self.path = path
+        self.gziPath = gziPath if gziPath is not None else path + '.gzi'
+        self.handle = open(path, 'rb')
+        if os.path.exists(self.gziPath):
+            self.compressed, self.uncompressed = readGzi(self.gziPath)
+        else:
+            self.compressed, self.uncompressed = self.scanBlocks()
+            try:
+                writeGzi(self.gziPath, self.compressed, self.uncompressed)
+            except IOError:
+                pass  # read-only directory; keep the index in memory
+        self.cachedBlock = None
+        self.cachedData = None
+
+    def scanBlocks(self):
+        """Returns the compressed and uncompressed start of every block,
+        reading only the block headers and ISIZE trailers."""
+        compressed, uncompressed = [], []
+        handle = self.handle
+        cOffset = uOffset = 0
+        fileSize = os.path.getsize(self.path)
+        while cOffset < fileSize:
+            handle.seek(cOffset)
+            header = handle.read(18)
+            if len(header) < 18 or header[12:14] != b'BC':
+                raise IndexedFastaError('%s is gzip but not BGZF compressed;'
+                                        ' recompress it with bgzip'
+                                        % self.path)
+            blockSize = struct.unpack('<H', header[16:18])[0] + 1
+            handle.seek(cOffset + blockSize - 4)
+            inputSize = struct.unpack('<I', handle.read(4))[0]
+            compressed.append(cOffset)
+            uncompressed.append(uOffset)
+            cOffset += blockSize
+            uOffset += inputSize
+        compressed.append(cOffset)
+        uncompressed.append(uOffset)
+        return compressed, uncompressed
+
+    def block(self, index):
+        if index != self.cachedBlock:
+            start = self.compressed[index]
+            self.handle.seek(start)
+            if index + 1 < len(self.compressed):
+                data = self.handle.read(self.compressed[index + 1] - start)
+            else:
+                data = self.handle.read()
+            self.cachedData = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+                .decompress(data)
+            self.cachedBlock = index
+        return self.cachedData
+
+    def read(self, start, end):
+        """Returns uncompressed bytes [start, end)."""
+        chunks = []
+        index = bisect_right(self.uncompressed, start) - 1
+        position = start
+        while position < end and index < len(self.compressed):
+            data = self.block(index)
+            blockStart = self.uncompressed[index]
+            if len(data) == 0 and index + 1 >= len(self.compressed):
+                break
+            chunk = data[position - blockStart:end - blockStart]
+            chunks.append(chunk)
+            position += len(chunk)
+            index += 1
+        return b''.join(chunks)
+
+    def lines(self):
+        """Generator over the uncompressed lines of the whole file."""
+        pending = b''
+        for index in range(len(self.compressed)):
+            pending += self.block(index)
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
+
+
+def readGzi(path):
+    """Reads a bgzip .gzi index into lists of compressed and uncompressed
+    block offsets, starting with the implicit first block at 0."""
+    with open(path, 'rb') as f:
+        count = struct.unpack('<Q', f.read(8))[0]
+        offsets = struct.unpack('<%dQ' % (2 * count), f.read(16 * count))
+    compressed = [0] + list(offsets[0::2])
+    uncompressed = [0] + list(offsets[1::2])
+    return compressed, uncompressed
+
+
+def writeGzi(path, compressed, uncompressed):
+    """Writes a bgzip-compatible .gzi index. The first block and the end of
+    file offsets are implicit and left out."""
+    pairs = list(zip(compressed[1:-1], uncompressed[1:-1]))
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(pairs)))
+        for pair in pairs:
+            f.write(struct.pack('<QQ', *pair))
+
+
+def readFai(path):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 5:
+                raise IndexedFastaError('Malformed .fai line: %r' % line)
+            entries.append(FaiEntry(fields[0], int(fields[1]),
+                                    int(fields[2]), int(fields[3]),
+                                    int(fields[4])))
+    return entries
+
+
+def writeFai(path, entries):
+    with open(path, 'w') as f:
+        for entry in entries:
+            f.write('\t'.join(str(field) for field in entry) + '\n')
+
+
+def toStr(data):
+    """Converts bytes read from a file to a native string."""
+    if isinstance(data, str):
+        return data
+    return data.decode('ascii')
+
+
+def sequenceName(header):
+    """The name of a sequence given its FASTA header line without the '>':
+    its first word, as in .fai indexes and 2bit files."""
+    fields = header.split()
+    return fields[0] if len(fields) > 0 else header[:0]
+
+
+def maskedBases(data):
+    """Counts the soft-masked (lower-case) bases in some bytes."""
+    return sum(len(run) for run in SOFT_MASKED.findall(data))
+
+
+def buildFai(lines):
+    """Builds .fai entries from an iterable of raw FASTA lines (bytes,
+    newline included). Every line of a sequence except the last must have
+    the same length, as samtools faidx requires."""
+    entries = []
+    offset = 0
+    name = None
+    for line in lines:
+        lineWidth = len(line)
+        offset += lineWidth
+        if line.startswith(b'>'):
+            if name is not None:
+                entries.append(FaiEntry(name, length, seqOffset, lineBases,
+                                        fullWidth))
+            name = toStr(sequenceName(line[1:]))
+            length = lineBases = fullWidth = 0
+            seqOffset = offset
+            shortLine = False
+            continue
+        bases = len(line.rstrip(b'\r\n'))
+        if name is None:
+            if bases > 0:
+                raise IndexedFastaError('Sequence before the first header')
+            continue
+        if bases == 0:
+            shortLine = True
+            continue
+        if lineBases == 0:
+            lineBases, fullWidth = bases, lineWidth
+        elif shortLine or bases > lineBases or \
+                (bases == lineBases and lineWidth != fullWidth):
+            raise IndexedFastaError('Inconsistent line lengths in %s' % name)
+        if bases < lineBases:
+            shortLine = True
+        length += bases
+    if name is not None:
+        entries.append(FaiEntry(name, length, seqOffset, lineBases,
+                                fullWidth))
+    return entries
+
+
+class IndexedFastaFile(dict):
+    """
+    Random-access FASTA reader. Like TwoBitFile, maps sequence names to
+    IndexedFastaSequence objects, e.g.
+    >>> genome = IndexedFastaFile('assembly.fa.gz')
+    >>> genome['scaffold1'][1000:1100]
+    """
+
+    def __init__(self, path, faiPath=None):
+        super(IndexedFastaFile, self).__init__()
+        self._path = path
+        if isBgzf(path):
+            self._reader = BgzfReader(path)
+            read = self._reader.read
+        elif isGzip(path):
+            raise IndexedFastaError('%s is gzip but not BGZF compressed; '
+                                    'recompress it with bgzip' % path)
+        else:
+            self._reader = open(path, 'rb')
+            read = self._readPlain
+        if faiPath is None:
+            faiPath = path + '.fai'
+        if os.path.exists(faiPath):
+            entries = readFai(faiPath)
+        else:
+            if isinstance(self._reader, BgzfReader):
+                entries = buildFai(self._reader.lines())
+            else:
+                entries = buildFai(self._reader)
+            try:
+                writeFai(faiPath, entries)
+            except IOError:
+                pass  # read-only directory; keep the index in memory
+        self._entries = entries
+        for entry in entries:
+            self[entry.name] = IndexedFastaSequence(read, entry)
+
+    def __reduce__(self):  # enables pickling
+        return (IndexedFastaFile, (self._path,))
+
+    def _readPlain(self, start, end):
+        self._reader.seek(start)
+        return self._reader.read(end - start)
+
+    def sequence_names(self):
+        """returns the sequence names in the order of the file"""
+        return [entry.name for entry in self._entries]
+
+    def sequence_sizes(self):
+        """returns a dictionary with the sizes of each sequence"""
+        return dict((entry.name, entry.length) for entry in self._entries)
+
+
+class IndexedFastaSequence(object):
+    """
+    A sequence in an IndexedFastaFile. Slicing and get_slice return the
+    sequence as written in the FASTA (soft-masking preserved); coordinates
+    are 0-based, end-open and truncated at the end of the sequence.
+    """
+
+    def __init__(self, read, entry):
+        self._read = read
+        self._entry = entry
+
+    def __len__(self):
+        return self._entry.length
+
+    def __getitem__(self, slice_or_key):
+        if isinstance(slice_or_key, slice):
+            if slice_or_key.step is not None:
+                raise ValueError("Slicing by step not currently supported")
+            return self.get_slice(slice_or_key.start, slice_or_key.stop)
+        max_ = slice_or_key + 1
+        if max_ == 0:
+            max_ = None
+        return self.get_slice(slice_or_key, max_)
+
+    def _fileOffset(self, position):
+        entry = self._entry
+        return entry.offset + (position // entry.lineBases) * entry.lineWidth \
+            + position % entry.lineBases
+
+    def _get_bytes(self, min_, max_):
+        """returns bases [min_, max_) as raw bytes"""
+        start, stop, _ = slice(min_, max_).indices(self._entry.length)
+        if start >= stop:
+            return b''
+        raw = self._read(self._fileOffset(start),
+                         self._fileOffset(stop - 1) + 1)
+        bases = raw.replace(b'\n', b'').replace(b'\r', b'')
+        if len(bases) != stop - start:
+            raise IndexedFastaError("Sequence was the wrong size; is the "
+                                    ".fai index stale?")
+        return bases
+
+    def get_slice(self, min_, max_=None):
+        """returns bases [min_, max_) as a string"""
+        return toStr(self._get_bytes(min_, max_))
+
+    def get_upper_slice(self, min_, max_=None):
+        """returns bases [min_, max_) upper-cased"""
+        return self.get_slice(min_, max_).upper()
+
+    def masked_bases(self, min_, max_=None):
+        """returns how many bases in [min_, max_) are soft-masked
+        (lower-case)"""
+        return maskedBases(self._get_bytes(min_, max_))
+
+    def mask_block_count(self):
+        """returns 0: soft-masking is counted from the bases, so no mask
+        blocks are held in memory"""
+        return 0
+
+    def n_blocks(self, chunkSize=1 << 22):
+        """yields (start, end) of each run of Ns, scanning the raw bytes of
+        the sequence in chunks of chunkSize bases"""
+        chunks = (self._get_bytes(start, start + chunkSize)
+                  for start in range(0, self._entry.length, chunkSize))
+        return nRunsInChunks(chunks)
+
+    def __str__(self):
+        return self.get_slice(0, None)
+
+
+def openGenome(path, cacheBytes=0, offsetIndex=False):
+    """Opens a 2bit file as a TwoBitFile, and anything else as an
+    IndexedFastaFile. cacheBytes sizes the TwoBitFile block cache. With
+    offsetIndex, a 2bit file's name->offset index is kept beside it as
+    <path>.offsets, so later opens need not parse it."""
+    if path.endswith('.2bit'):
+        from twobitreader import TwoBitFile
+        offsetPath = path + '.offsets' if offsetIndex else None
+        return TwoBitFile(path, cache_bytes=cacheBytes,
+                          offset_index=offsetPath)
+    return IndexedFastaFile(path)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+"""Fast detection of runs of Ns (scaffold gaps) in raw sequence buffers.
+
+Buffers are scanned a chunk at a time. With NumPy installed, run boundaries
+in each chunk are found with vectorized comparisons and a diff; otherwise a
+bytes regular expression does the scan. Runs that cross chunk edges are
+joined, so results do not depend on the chunk size.
+"""
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+N_RUN = re.compile(b'[Nn]+')
+CHUNK_SIZE = 1 << 22
+
+
+def toBytes(sequence):
+    """Returns a str/bytes/buffer sequence as something bytes-like."""
+    if isinstance(sequence, bytes):
+        return sequence
+    if hasattr(sequence, 'encode'):
+        return sequence.encode('ascii')
+    return sequence
+
+
+def chunkRunsNumpy(chunk):
+    """Returns arrays of the starts and ends of the N runs in one chunk."""
+    bases = numpy.frombuffer(chunk, dtype=numpy.uint8)
+    # 'N' | 0x20 == 'n', and no other byte maps to 'n'
+    isN = numpy.empty(len(bases) + 2, dtype=numpy.int8)
+    isN[0] = isN[-1] = 0
+    numpy.equal(bases | 0x20, ord('n'), out=isN[1:-1], casting='unsafe')
+    edges = numpy.diff(isN)
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+
+def chunkRunsRegex(chunk):
+    """Like chunkRunsNumpy, using a bytes regular expression."""
+    starts, ends = [], []
+    for match in N_RUN.finditer(chunk):
+        starts.append(match.start())
+        ends.append(match.end())
+    return starts, ends
+
+
+def nRunsInChunks(chunks, minGapSize=1):
+    """Generator yielding (start, end) for each run of Ns in a sequence
+    given as consecutive byte chunks, skipping runs shorter than
+    minGapSize."""
+    chunkRuns = chunkRunsNumpy if numpy is not None else chunkRunsRegex
+    runStart = runEnd = None
+    offset = 0
+    for chunk in chunks:
+        starts, ends = chunkRuns(chunk)
+        for start, end in zip(starts, ends):
+            start = offset + int(start)
+            end = offset + int(end)
+            if runEnd == start:
+                # Continues a run that reached the end of the last chunk
+                runEnd = end
+                continue
+            if runStart is not None and runEnd - runStart >= minGapSize:
+                yield runStart, runEnd
+            runStart, runEnd = start, end
+        offset += len(chunk)
+    if runStart is not None and runEnd - runStart >= minGapSize:
+        yield runStart, runEnd
+
+
+def nRuns(sequence, minGapSize=1, chunkSize=CHUNK_SIZE):
+    """Generator yielding (start, end) for each run of Ns in a sequence,
+    matching re.finditer(r"[Nn]+") on the same sequence."""
+    sequence = toBytes(sequence)
+    chunks = (sequence[i:i + chunkSize]
+              for i in range(0, len(sequence), chunkSize))
+    return nRunsInChunks(chunks, minGapSize)
@@ -8,12 +8,14 @@ from argparse import ArgumentParser
 from collections import defaultdict, namedtuple
 
 from sonLib.bioio import fastaRead, fastaWrite
+from indexedFasta import sequenceName
 
 FalseDup = namedtuple('FalseDup', ['gapStart', 'gapEnd', 'dupSize'])
 
 def parse_dups_file(path):
     """
-    Parse a .dups file produced by findScaffoldGapDups.
+    Parse a .dups file produced by findScaffoldGapDups into lists of
+    dups keyed by sequence name (the first word of the FASTA header).
     """
     dups = defaultdict(list)
     with open(path) as f:
@@ -25,6 +27,36 @@ def parse_dups_file(path):
             dups[fields[0]].append(FalseDup(int(fields[1]), int(fields[2]), int(fields[3])))
     return dups
 
+def trim_sequence(sequence, dups, additional=0):
+    """
+    Remove the duplicated regions (plus additional bases) on both sides of
+    each gap in dups from sequence. Works on the intervals to cut rather
+    than deleting from a list, so it is linear in the sequence length.
+    """
+    cuts = []
+    for dup in dups:
+        cuts.append((max(0, dup.gapStart - dup.dupSize - additional),
+                     dup.gapStart))
+        cuts.append((dup.gapEnd, dup.gapEnd + dup.dupSize + additional))
+    cuts.sort()
+    pieces = []
+    kept = 0
+    for start, end in cuts:
+        if start > kept:
+            pieces.append(sequence[kept:start])
+        kept = max(kept, end)
+    pieces.append(sequence[kept:])
+    return ''.join(pieces)
+
+def trim_records(records, dups, additional=0):
+    """
+    Trim the dups of each (header, sequence) FASTA record, matching
+    records to dups on the sequence name and keeping the full header.
+    """
+    for header, sequence in records:
+        yield header, trim_sequence(sequence, dups[sequenceName(header)],
+                                    additional)
+
 def main():
     parser = ArgumentParser(description=__doc__)
     parser.add_argument('fasta', help='Sequence file')
@@ -34,15 +66,9 @@ def main():
     opts = parser.parse_args()
     # Ingest dup locations
     dups = parse_dups_file(opts.dups)
-    for header, sequence in fastaRead(opts.fasta):
-        sequence_dups = dups[header]
-        offset = 0
-        sequence = list(sequence)
-        for dup in sequence_dups:
-            del sequence[dup.gapEnd - offset:dup.gapEnd + dup.dupSize + opts.additional - offset]
-            del sequence[dup.gapStart - dup.dupSize - opts.additional - offset:dup.gapStart - offset]
-            offset += 2 * (dup.dupSize + opts.additional)
-        fastaWrite(sys.stdout, header, ''.join(sequence))
+    for header, sequence in trim_records(fastaRead(opts.fasta), dups,
+                                         opts.additional):
+        fastaWrite(sys.stdout, header, sequence)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+"""Find, filter and trim the false tandem duplications around scaffold gaps
+in a single process.
+
+Equivalent to running findScaffoldGapDups, filterDups, dupsToBed and
+remove_overlap in turn, but duplications are streamed between the stages
+as records and the genome is read once, scaffold by scaffold. The .dups,
+filtered .dups and BED files that used to be hand-offs between the tools
+are optional outputs.
+"""
+import sys
+from argparse import ArgumentParser
+from sonLib.bioio import fastaWrite
+from indexedFasta import openGenome
+from gapIndex import openGapIndex
+from findScaffoldGapDups import DUPS_HEADER, addMaskOptions, \
+    alignWithBlat, alignWithFastPath, findDups, formatDup, genomeFlanks, \
+    maskFilterFor
+from filterDups import filterDupRecords
+from dupsToBed import bedLines
+from remove_overlap import trim_sequence
+
+
+def writeDups(dups, outfile):
+    """Passes Dup records through, writing each to a dups file."""
+    outfile.write(DUPS_HEADER + '\n')
+    for dup in dups:
+        outfile.write(formatDup(dup) + '\n')
+        yield dup
+
+
+def writeBed(dups, outfile):
+    """Passes Dup records through, writing their regions to a BED file."""
+    for dup in dups:
+        for line in bedLines(dup.sequence, dup):
+            outfile.write(line + '\n')
+        yield dup
+
+
+def trimmedScaffolds(genome, names, dups, additional=0):
+    """Generator yielding (name, trimmed sequence) for every scaffold in
+    names, given Dup records in the same scaffold order."""
+    dups = iter(dups)
+    pending = next(dups, None)
+    for name in names:
+        scaffoldDups = []
+        while pending is not None and pending.sequence == name:
+            scaffoldDups.append(pending)
+            pending = next(dups, None)
+        yield name, trim_sequence(str(genome[name]), scaffoldDups, additional)
+    # Drain the stream so every optional output is complete
+    for _ in dups:
+        pass
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('genome', help='2bit or (bgzip) fasta file')
+    parser.add_argument('--maxSize', help='maximum size to attempt to check',
+                        type=int, default=5000)
+    parser.add_argument('-s', help='duplication size', type=int,
+                        default=0, dest="dupSize")
+    parser.add_argument('-%', help='percent identity', type=float,
+                        default=0.0, dest="percentID")
+    parser.add_argument('--additional', type=int, default=0,
+                        help='Additional amount to trim past the dup')
+    parser.add_argument('--dups', help='also write all dups here')
+    parser.add_argument('--filteredDups', help='also write filtered dups here')
+    parser.add_argument('--bed', help='also write filtered dups as BED here')
+    parser.add_argument('--output', help='trimmed fasta (default: stdout)')
+    parser.add_argument('--fastPath', action='store_true',
+                        help='call exact and near-exact overlaps without '
+                        'blat (experimental)')
+    parser.add_argument('--workers', help='number of concurrent alignments',
+                        type=int, default=1)
+    parser.add_argument('--queueDepth', type=int, default=16,
+                        help='maximum number of gaps fetched ahead of the '
+                        'alignments')
+    addMaskOptions(parser)
+    opts = parser.parse_args()
+
+    genome = openGenome(opts.genome)
+    gapIndex = openGapIndex(opts.genome, genome=genome)
+    aligner = alignWithFastPath if opts.fastPath else alignWithBlat
+    maskFilter = maskFilterFor(opts)
+
+    files = []
+    try:
+        dups = findDups(genomeFlanks(genome, opts.maxSize, gapIndex,
+                                     maskFilter),
+                        aligner=aligner, workers=opts.workers,
+                        queueDepth=opts.queueDepth)
+        if opts.dups is not None:
+            files.append(open(opts.dups, 'w'))
+            dups = writeDups(dups, files[-1])
+        dups = filterDupRecords(dups, opts.dupSize, opts.percentID)
+        if opts.filteredDups is not None:
+            files.append(open(opts.filteredDups, 'w'))
+            dups = writeDups(dups, files[-1])
+        if opts.bed is not None:
+            files.append(open(opts.bed, 'w'))
+            dups = writeBed(dups, files[-1])
+
+        if opts.output is not None:
+            files.append(open(opts.output, 'w'))
+            output = files[-1]
+        else:
+            output = sys.stdout
+        for name, sequence in trimmedScaffolds(genome, gapIndex.names(),
+                                               dups, opts.additional):
+            fastaWrite(output, name, sequence)
+    finally:
+        for f in files:
+            f.close()
+    if maskFilter is not None:
+        sys.stderr.write("masked gaps\t" + maskFilter.summary() + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+"""Files kept beside an assembly and rebuilt when it changes.
+
+The gap index and the decoded genome share this layout and life cycle: a
+header recording the size, mtime and MD5 checksum of the assembly the file
+was built from, written to a temporary file and renamed into place so
+readers never see it half-written, and a fallback location in the temporary
+directory (or one the caller picks, such as a parallel run's shared
+directory) for assemblies in directories we cannot write to.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+# magic, source size, source mtime, source md5, entry count
+HEADER = struct.Struct('<8sQd16sI')
+# offset of the source mtime in HEADER
+MTIME_OFFSET = 8 + 8
+
+
+def fileChecksum(path, chunkSize=1 << 20):
+    """Returns the MD5 digest of a file's contents."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunkSize)
+            if not chunk:
+                break
+            md5.update(chunk)
+    return md5.digest()
+
+
+def packHeader(magic, assembly, count):
+    """Returns the header of a sidecar with count entries built from the
+    assembly as it is now."""
+    stat = os.stat(assembly)
+    return HEADER.pack(magic, stat.st_size, stat.st_mtime,
+                       fileChecksum(assembly), count)
+
+
+def writeAtomically(path, write):
+    """Calls write(f) on a temporary file beside path, then renames it to
+    path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tempPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            write(f)
+        os.chmod(tempPath, 0o644)
+        os.rename(tempPath, path)
+    except Exception:
+        os.remove(tempPath)
+        raise
+
+
+class Sidecar(object):
+    """A memory-mapped sidecar file. Subclasses set MAGIC and KIND and call
+    mapSidecar from their constructor."""
+    MAGIC = None
+    KIND = 'sidecar'
+
+    def mapSidecar(self, path):
+        """Maps the file at path and reads its header, returning the entry
+        count. Raises ValueError if it is not a sidecar of this kind."""
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.path.getsize(path) < HEADER.size:
+                raise ValueError('%s is too short to be a %s' % (path,
+                                                                self.KIND))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.sourceSize, self.sourceMtime, self.checksum, count = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            self._map.close()
+            raise ValueError('%s is not a %s' % (path, self.KIND))
+        return count
+
+    def matches(self, assembly):
+        """Checks that this file was built from the assembly as it is now.
+        The checksum is only recomputed if the size or mtime changed."""
+        stat = os.stat(assembly)
+        if stat.st_size != self.sourceSize:
+            return False
+        if stat.st_mtime == self.sourceMtime:
+            return True
+        return fileChecksum(assembly) == self.checksum
+
+    def close(self):
+        self._map.close()
+
+
+def updateSourceMtime(path, mtime):
+    """Records a new mtime for an assembly whose contents are unchanged."""
+    with open(path, 'r+b') as f:
+        f.seek(MTIME_OFFSET)
+        f.write(struct.pack('<d', mtime))
+
+
+def cachePath(assembly, suffix, directory=None):
+    """Sidecar location in directory (by default the temporary directory),
+    for assemblies in directories we cannot write to."""
+    key = hashlib.md5(os.path.abspath(assembly).encode('utf-8')).hexdigest()
+    if directory is None:
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, '%s.%s%s' % (
+        os.path.basename(assembly), key[:12], suffix))
+
+
+def openSidecar(assembly, paths, load, write, build=True):
+    """Returns load(path) for the first of paths holding an up-to-date
+    sidecar of the assembly. Otherwise builds one with write(path) at the
+    first of paths that can be written, and loads that; or, without build,
+    raises ValueError."""
+    for candidate in paths:
+        if not os.path.exists(candidate):
+            continue
+        try:
+            sidecar = load(candidate)
+        except (IOError, OSError, ValueError):
+            continue
+        if sidecar.matches(assembly):
+            mtime = os.stat(assembly).st_mtime
+            if mtime != sidecar.sourceMtime and os.access(candidate, os.W_OK):
+                updateSourceMtime(candidate, mtime)
+            return sidecar
+        sidecar.close()
+    if not build:
+        raise ValueError('No up-to-date sidecar of %s at %s' % (
+            assembly, ', '.join(paths)))
+    for candidate in paths:
+        try:
+            write(candidate)
+        except (IOError, OSError):
+            if candidate == paths[-1]:
+                raise
+            continue
+        return load(candidate)
@@ -0,0 +1,106 @@
+"""Small assemblies written in-test: 2bit (either version and byte order),
+plain FASTA (LF or CRLF line endings) and BGZF-compressed FASTA."""
+import os
+import re
+import struct
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TWOBIT_SIGNATURE = 0x1A412743
+TWOBIT_CODES = {'T': 0, 'C': 1, 'A': 2, 'G': 3}
+
+# scaffold name and sequence, in file order; soft-masked runs and gaps of
+# Ns, including one at each end and a scaffold with none
+SEQUENCES = [
+    ('scaffold2', 'ACGTTGCAacgtaCCGGTTAANNNNNNNNNNGGCCTTAAcgtacgTTAC'
+                  'GATCGATCNNNNNGATTACAgattaca'),
+    ('scaffold10', 'NNNNACGTACGTAAACCCGGGTTTacgNNNNNNNNNNNNNNNNNNNNNNN'
+                   'TTTGGGCCCAAAtttgggcccaaaTGCATGCATGCANN'),
+    ('chrUn', 'GATTACAgattacaGATTACAGATTACAGATTAC'),
+    ('a', 'ACGTNACGTNNacgt'),
+]
+
+
+def nRuns(sequence):
+    """(start, end) of each run of Ns in a sequence."""
+    return [match.span() for match in re.finditer('[Nn]+', sequence)]
+
+
+def write2bit(path, sequences, version=0, byteorder='<'):
+    """Writes (name, sequence) pairs to a 2bit file."""
+    offsetFormat = byteorder + ('Q' if version == 1 else 'I')
+    indexSize = sum(1 + len(name) + struct.calcsize(offsetFormat)
+                    for name, _ in sequences)
+    offset = 16 + indexSize
+    index, records = [], []
+    for name, sequence in sequences:
+        blocks = nRuns(sequence)
+        masks = [match.span() for match in re.finditer('[a-z]+', sequence)]
+        record = [struct.pack(byteorder + 'II', len(sequence), len(blocks))]
+        record += [struct.pack(byteorder + 'I', start) for start, _ in blocks]
+        record += [struct.pack(byteorder + 'I', end - start)
+                   for start, end in blocks]
+        record.append(struct.pack(byteorder + 'I', len(masks)))
+        record += [struct.pack(byteorder + 'I', start) for start, _ in masks]
+        record += [struct.pack(byteorder + 'I', end - start)
+                   for start, end in masks]
+        record.append(struct.pack(byteorder + 'I', 0))
+        bases = sequence.upper().replace('N', 'T')
+        bases += 'T' * (-len(bases) % 4)
+        packed = bytearray()
+        for i in range(0, len(bases), 4):
+            value = 0
+            for base in bases[i:i + 4]:
+                value = (value << 2) | TWOBIT_CODES[base]
+            packed.append(value)
+        record.append(bytes(packed))
+        record = b''.join(record)
+        index.append(struct.pack('B', len(name)) + name.encode('ascii') +
+                     struct.pack(offsetFormat, offset))
+        records.append(record)
+        offset += len(record)
+    with open(path, 'wb') as f:
+        f.write(struct.pack(byteorder + 'IIII', TWOBIT_SIGNATURE, version,
+                            len(sequences), 0))
+        f.write(b''.join(index))
+        f.write(b''.join(records))
+
+
+def fastaBytes(sequences, lineWidth=10, newline='\n'):
+    lines = []
+    for name, sequence in sequences:
+        lines.append('>' + name + ' description')
+        lines += [sequence[i:i + lineWidth]
+                  for i in range(0, len(sequence), lineWidth)]
+    return ''.join(line + newline for line in lines).encode('ascii')
+
+
+def writeFasta(path, sequences, lineWidth=10, newline='\n'):
+    with open(path, 'wb') as f:
+        f.write(fastaBytes(sequences, lineWidth, newline))
+
+
+def bgzfBlock(data):
+    """One BGZF block: a gzip member with the BC extra field."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    blockSize = 18 + len(deflated) + 8
+    header = struct.pack('<BBBBIBBH2sHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                         b'BC', 2, blockSize - 1)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+    return header + deflated + trailer
+
+
+def writeBgzf(path, data, blockSize=64):
+    """Writes data as BGZF, blockSize uncompressed bytes per block (small,
+    so slices cross block boundaries), followed by the empty EOF block."""
+    with open(path, 'wb') as f:
+        for start in range(0, len(data), blockSize):
+            f.write(bgzfBlock(data[start:start + blockSize]))
+        f.write(bgzfBlock(b''))
+
+
+def touch(path, mtime):
+    os.utime(path, (mtime, mtime))
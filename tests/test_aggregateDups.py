@@ -0,0 +1,32 @@
+import unittest
+
+from aggregateDups import binCenter
+
+
+def bruteBinCenter(dupSize, binSize):
+    """The multiple of binSize whose (center - binSize/2,
+    center + binSize/2] bin holds dupSize, as ggplot2 bins."""
+    center = 0
+    while dupSize > center + binSize / 2.0:
+        center += binSize
+    while dupSize <= center - binSize / 2.0:
+        center -= binSize
+    return center
+
+
+class BinCenterTest(unittest.TestCase):
+    def testMatchesBins(self):
+        for binSize in (1, 2, 5, 10, 100):
+            for dupSize in range(0, 1001):
+                self.assertEqual(binCenter(dupSize, binSize),
+                                 bruteBinCenter(dupSize, binSize))
+
+    def testRightClosed(self):
+        self.assertEqual(binCenter(5, 10), 0)
+        self.assertEqual(binCenter(6, 10), 10)
+        self.assertEqual(binCenter(15, 10), 10)
+        self.assertEqual(binCenter(16, 10), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
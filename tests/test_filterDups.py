@@ -0,0 +1,43 @@
+import unittest
+from collections import namedtuple
+
+from filterDups import filterDupRecords, filterDups
+
+# the fields of findScaffoldGapDups.Dup
+Dup = namedtuple('Dup', ['sequence', 'gapStart', 'gapEnd', 'dupSize',
+                         'dupPctID'])
+
+DUPS = [Dup('a', 100, 110, 20, 100.0),
+        Dup('a', 500, 510, 21, 94.94),
+        Dup('b', 100, 150, 300, 94.96),
+        Dup('b', 900, 950, 50, 99.0),
+        Dup('c', 10, 20, 1000, 80.0)]
+
+
+def dupsLines(dups):
+    return ['sequence\tgapStart\tgapEnd\tdupSize\tdupPctID\n'] + \
+        ['{}\t{}\t{}\t{}\t{:.1f}\n'.format(*dup) for dup in dups]
+
+
+class FilterDupRecordsTest(unittest.TestCase):
+    def testSizeAndIdentity(self):
+        self.assertEqual(list(filterDupRecords(DUPS, 50, 95.0)),
+                         [DUPS[2], DUPS[3]])
+
+    def testIdentityAsWritten(self):
+        # 94.96 is written as 95.0, so filterDups keeps it
+        self.assertEqual(list(filterDupRecords(DUPS[2:3], 0, 95.0)),
+                         DUPS[2:3])
+
+    def testMatchesFilterDups(self):
+        for dupSize, percentID in [(0, 0.0), (21, 0.0), (0, 95.0),
+                                   (50, 99.0), (2000, 0.0)]:
+            lines = list(filterDups(iter(dupsLines(DUPS)), dupSize,
+                                    percentID))
+            records = list(filterDupRecords(DUPS, dupSize, percentID))
+            self.assertEqual(lines[1:], [line.rstrip() for line in
+                                         dupsLines(records)[1:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
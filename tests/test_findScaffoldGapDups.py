@@ -0,0 +1,166 @@
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from genomes import write2bit, writeFasta
+from gapIndex import openGapIndex
+from indexedFasta import openGenome
+
+try:
+    from findScaffoldGapDups import AlignmentTimeout, MaskFilter, \
+        alignFlanks, exactOverlap, fastaFlanks, findGaps, genomeFlanks, \
+        popenCatchWithTimeout
+except ImportError:  # sonLib is not installed
+    exactOverlap = None
+
+
+def randomBases(rng, size):
+    return ''.join(rng.choice('ACGT') for _ in range(size))
+
+
+@unittest.skipIf(exactOverlap is None, 'needs sonLib')
+class ExactOverlapTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1)
+
+    def testExactOverlap(self):
+        before = randomBases(self.rng, 500)
+        after = before[-120:] + randomBases(self.rng, 380)
+        self.assertEqual(exactOverlap(before, after), (120, 100.0))
+
+    def testMismatchScoredOverWholeOverlap(self):
+        before = randomBases(self.rng, 500)
+        overlap = list(before[-200:])
+        overlap[100] = 'A' if overlap[100] != 'A' else 'C'
+        after = ''.join(overlap) + randomBases(self.rng, 300)
+        self.assertEqual(exactOverlap(before, after), (199, 99.5))
+
+    def testRepeatMismatchLeftToBlat(self):
+        # the 196 bp overlap is exact, but the real one is 200 bp with a
+        # mismatch 3 bp from its end
+        repeat = 'ACGT' * 50
+        before = randomBases(self.rng, 100) + repeat
+        after = repeat[:-3] + 'T' + repeat[-2:] + \
+            randomBases(self.rng, 300)
+        self.assertEqual(exactOverlap(before, after), None)
+
+    def testShortOverlapLeftToBlat(self):
+        before = randomBases(self.rng, 500)
+        after = before[-30:] + randomBases(self.rng, 470)
+        self.assertEqual(exactOverlap(before, after), None)
+
+
+@unittest.skipIf(exactOverlap is None, 'needs sonLib')
+class FindGapsTest(unittest.TestCase):
+    def testMatchesFinditer(self):
+        rng = random.Random(3)
+        sequence = ''.join(rng.choice('ACGTacgtNNNNn') for _ in range(5000))
+        for minGapSize in (1, 2, 4):
+            self.assertEqual(
+                list(findGaps(sequence, minGapSize)),
+                [match.span() for match in re.finditer('[Nn]+', sequence)
+                 if match.end() - match.start() >= minGapSize])
+
+
+@unittest.skipIf(exactOverlap is None, 'needs sonLib')
+class AlignFlanksTest(unittest.TestCase):
+    def testResultsInInputOrder(self):
+        rng = random.Random(5)
+        delays = [rng.choice([0, 0.001, 0.02]) for _ in range(60)]
+
+        def aligner(seq1, seq2):
+            time.sleep(delays[int(seq1)])
+            return int(seq1), 100.0
+
+        flanks = [(i, str(i), 'ACGT') for i in range(len(delays))]
+        results = list(alignFlanks(flanks, aligner, workers=4))
+        self.assertEqual([result[0] for result in results],
+                         list(range(len(delays))))
+        self.assertEqual([result[1] for result in results],
+                         list(range(len(delays))))
+        self.assertEqual(set(result[4] for result in results), set(['ok']))
+
+    def testFetchingWaitsForSlowAlignment(self):
+        # while the first alignment is stuck, at most queueDepth gaps are
+        # fetched and waiting, plus the one the producer holds
+        fetched = []
+        release = threading.Event()
+
+        def flanks():
+            for i in range(100):
+                fetched.append(i)
+                yield i, 'A', 'C'
+
+        def aligner(seq1, seq2):
+            release.wait()
+            return 0, 0.0
+
+        results = []
+        consumer = threading.Thread(target=lambda: results.extend(
+            alignFlanks(flanks(), aligner, workers=2, queueDepth=5)))
+        consumer.daemon = True
+        consumer.start()
+        time.sleep(0.5)
+        self.assertTrue(5 <= len(fetched) <= 6)
+        release.set()
+        consumer.join(10)
+        self.assertEqual(len(results), 100)
+
+    def testTimeoutKillsProcessGroup(self):
+        directory = tempfile.mkdtemp()
+        try:
+            script = os.path.join(directory, 'spawn.sh')
+            marker = os.path.join(directory, 'survived')
+            with open(script, 'w') as f:
+                f.write('(sleep 2; touch %s) &\nsleep 60\n' % marker)
+            with self.assertRaises(AlignmentTimeout):
+                popenCatchWithTimeout('sh ' + script, '', 0.5)
+            time.sleep(2.5)
+            self.assertFalse(os.path.exists(marker))
+        finally:
+            shutil.rmtree(directory)
+
+
+@unittest.skipIf(exactOverlap is None, 'needs sonLib')
+class GenomeFlanksTest(unittest.TestCase):
+    # a masked gap, an unmasked one, and masked gaps without enough flank
+    SEQUENCES = [('masked', 'ACGTACGTacgtacgtacgtNNNNNacgtacgtacgtACGTACGT'),
+                 ('plain', 'ACGTACGTACGTACGTNNNNNACGTACGTACGTACGT'),
+                 ('ends', 'acgNNNNNacgtacgtacgtacgtacgtNNNNNNNNacgt')]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.2bit')
+        write2bit(self.path, self.SEQUENCES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testMaskFilterCountsOnlyGapsWithFlanks(self):
+        maskFilter = MaskFilter('skip', window=10, maxFraction=0.8)
+        genome = openGenome(self.path)
+        flanks = list(genomeFlanks(genome, 100, openGapIndex(self.path),
+                                   maskFilter))
+        self.assertEqual([item[0] for item in flanks], [('plain', 16, 21)])
+        self.assertEqual(maskFilter.counts,
+                         {'checked': 2, 'skipped': 1, 'exactOnly': 0})
+
+    def testFastaNamesMatchIndexedNames(self):
+        # headers carry a description after the name
+        path = os.path.join(self.directory, 'test.fa')
+        writeFasta(path, self.SEQUENCES)
+        with open(path) as f:
+            plain = list(fastaFlanks(f, 100))
+        indexed = list(genomeFlanks(openGenome(path), 100,
+                                    openGapIndex(path)))
+        self.assertEqual(plain, indexed)
+        self.assertEqual([item[0][0] for item in plain], ['masked', 'plain'])
+
+
+if __name__ == '__main__':
+    unittest.main()
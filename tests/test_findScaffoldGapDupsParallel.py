@@ -0,0 +1,102 @@
+import unittest
+
+from gapTable import GapArrays
+
+try:
+    from findScaffoldGapDupsParallel import BLOCK_MEMORY, \
+        DEFAULT_ALIGN_OPTIONS, alignMemory, batchGaps, gapCost, interleave
+except ImportError:  # sonLib or jobTree is not installed
+    batchGaps = None
+
+
+def makeGaps(flankSizes):
+    """GapArrays of one scaffold with gaps whose flanks total the given
+    sizes, split evenly on both sides."""
+    gaps = GapArrays(['scaffold'])
+    position = 0
+    for flankSize in flankSizes:
+        start = position + flankSize // 2
+        end = start + 10
+        gaps.append(0, start, end, position, end + flankSize // 2)
+        position = end + flankSize // 2
+    return gaps
+
+
+@unittest.skipIf(batchGaps is None, 'needs sonLib and jobTree')
+class BatchGapsTest(unittest.TestCase):
+    def cost(self, gaps, start, end):
+        return sum(gapCost(gaps, i) for i in range(start, end))
+
+    def check(self, gaps, batches, split):
+        self.assertEqual([start for start, _ in batches],
+                         [0] + [end for _, end in batches[:-1]])
+        self.assertEqual(batches[-1][1], len(gaps))
+        for start, end in batches:
+            self.assertTrue(0 < end - start <= split)
+
+    def testEqualGapsFillSplit(self):
+        gaps = makeGaps([1000] * 100)
+        batches = list(batchGaps(gaps, 25))
+        self.check(gaps, batches, 25)
+        self.assertEqual(batches, [(0, 25), (25, 50), (50, 75), (75, 100)])
+
+    def testEqualGapsShareOutRemainder(self):
+        gaps = makeGaps([1000] * 100)
+        batches = list(batchGaps(gaps, 40))
+        self.check(gaps, batches, 40)
+        self.assertEqual([end - start for start, end in batches],
+                         [33, 33, 34])
+
+    def testLargeGapsMakeShorterBatches(self):
+        # batches of 50 would put all the large gaps in one of them, at
+        # twice the cost of the other
+        for flankSizes in ([10000] * 10 + [20] * 90,
+                           [20] * 90 + [10000] * 10):
+            gaps = makeGaps(flankSizes)
+            batches = list(batchGaps(gaps, 50))
+            self.check(gaps, batches, 50)
+            total = self.cost(gaps, 0, len(gaps))
+            self.assertEqual(len(batches), 3)
+            for start, end in batches:
+                self.assertTrue(self.cost(gaps, start, end) <= total / 2)
+
+    def testNoGaps(self):
+        self.assertEqual(list(batchGaps(makeGaps([]), 10)), [])
+
+
+@unittest.skipIf(batchGaps is None, 'needs sonLib and jobTree')
+class AlignMemoryTest(unittest.TestCase):
+    # enough blocks to lift every estimate above MIN_MEMORY
+    BLOCKS = 10 ** 7
+
+    def memory(self, blockCount, decoded=False, maskedGaps=None):
+        gaps = makeGaps([10000] * 10)
+        options = DEFAULT_ALIGN_OPTIONS._replace(maskedGaps=maskedGaps)
+        return alignMemory(1, gaps, 0, len(gaps), options, decoded,
+                           blockCount)
+
+    def testBlocksOfOpenGenome(self):
+        self.assertEqual(self.memory(2 * self.BLOCKS) -
+                         self.memory(self.BLOCKS),
+                         BLOCK_MEMORY * self.BLOCKS)
+
+    def testDecodedGenomeOpenedOnlyToFilterMaskedGaps(self):
+        self.assertEqual(self.memory(2 * self.BLOCKS, decoded=True),
+                         self.memory(self.BLOCKS, decoded=True))
+        self.assertEqual(self.memory(2 * self.BLOCKS, True, 'exact') -
+                         self.memory(self.BLOCKS, True, 'exact'),
+                         BLOCK_MEMORY * self.BLOCKS)
+
+
+@unittest.skipIf(batchGaps is None, 'needs sonLib and jobTree')
+class InterleaveTest(unittest.TestCase):
+    def testRoundRobin(self):
+        self.assertEqual(interleave([[1, 2, 3], ['a'], [], ['x', 'y']]),
+                         [1, 'a', 'x', 2, 'y', 3])
+
+    def testEmpty(self):
+        self.assertEqual(interleave([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
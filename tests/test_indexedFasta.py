@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from genomes import SEQUENCES, fastaBytes, nRuns, writeBgzf, writeFasta
+from indexedFasta import IndexedFastaFile, buildFai, openGenome
+
+
+class IndexedFastaTest(unittest.TestCase):
+    """Slices of plain and BGZF FASTA, with LF and CRLF line endings, match
+    slices of the sequences as written."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, newline, bgzf):
+        path = os.path.join(self.directory, 'test.fa')
+        if bgzf:
+            path += '.gz'
+            writeBgzf(path, fastaBytes(SEQUENCES, newline=newline))
+        else:
+            writeFasta(path, SEQUENCES, newline=newline)
+        return path
+
+    def check(self, path):
+        for _ in range(2):  # builds the indexes, then reads them
+            genome = openGenome(path)
+            self.assertTrue(isinstance(genome, IndexedFastaFile))
+            self.assertEqual(genome.sequence_names(),
+                             [name for name, _ in SEQUENCES])
+            self.assertEqual(genome.sequence_sizes(),
+                             dict((name, len(sequence))
+                                  for name, sequence in SEQUENCES))
+            for name, sequence in SEQUENCES:
+                self.assertEqual(str(genome[name]), sequence)
+                for start in range(len(sequence)):
+                    for end in (start + 1, start + 11, start + 25):
+                        self.assertEqual(genome[name][start:end],
+                                         sequence[start:end])
+                self.assertEqual(genome[name][-3:], sequence[-3:])
+                self.assertEqual(genome[name].get_upper_slice(2, 30),
+                                 sequence[2:30].upper())
+                self.assertEqual(genome[name].masked_bases(0, None),
+                                 sum(1 for base in sequence
+                                     if base.islower()))
+                self.assertEqual(list(genome[name].n_blocks(chunkSize=8)),
+                                 nRuns(sequence))
+        self.assertTrue(os.path.exists(path + '.fai'))
+
+    def testPlainLf(self):
+        self.check(self.write('\n', False))
+
+    def testPlainCrlf(self):
+        self.check(self.write('\r\n', False))
+
+    def testBgzfLf(self):
+        path = self.write('\n', True)
+        self.check(path)
+        self.assertTrue(os.path.exists(path + '.gzi'))
+
+    def testBgzfCrlf(self):
+        self.check(self.write('\r\n', True))
+
+    def testFaiMatchesLineLayout(self):
+        lines = fastaBytes(SEQUENCES, newline='\r\n').splitlines(True)
+        entries = buildFai(lines)
+        self.assertEqual([entry.name for entry in entries],
+                         [name for name, _ in SEQUENCES])
+        self.assertEqual(set((entry.lineBases, entry.lineWidth)
+                             for entry in entries), set([(10, 12)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import random
+import re
+import unittest
+
+import nRuns as nRunsModule
+from nRuns import nRuns
+
+
+def expectedRuns(sequence, minGapSize=1):
+    return [match.span() for match in re.finditer('[Nn]+', sequence)
+            if match.end() - match.start() >= minGapSize]
+
+
+def randomSequence(rng, size):
+    # long and short runs of N and n, at the ends too
+    pieces = []
+    while sum(len(piece) for piece in pieces) < size:
+        if rng.random() < 0.3:
+            pieces.append(''.join(rng.choice('Nn')
+                                  for _ in range(rng.choice([1, 2, 5, 40]))))
+        else:
+            pieces.append(''.join(rng.choice('ACGTacgt')
+                                  for _ in range(rng.randint(1, 30))))
+    return ''.join(pieces)
+
+
+class NRunsTest(unittest.TestCase):
+    SEQUENCES = ['', 'ACGT', 'N', 'NNNN', 'nNnN', 'NACGTN', 'ACnnGTNNNNAC',
+                 'NNNNACGTNNNNNNNNACGTnnnn']
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.sequences = self.SEQUENCES + [randomSequence(rng, 500)
+                                           for _ in range(20)]
+
+    def check(self):
+        for sequence in self.sequences:
+            for chunkSize in (1, 2, 3, 7, 64, 1 << 22):
+                for minGapSize in (1, 3):
+                    self.assertEqual(
+                        list(nRuns(sequence, minGapSize, chunkSize)),
+                        expectedRuns(sequence, minGapSize))
+
+    def testMatchesFinditer(self):
+        self.check()
+
+    def testRegexMatchesFinditer(self):
+        numpy = nRunsModule.numpy
+        nRunsModule.numpy = None
+        try:
+            self.check()
+        finally:
+            nRunsModule.numpy = numpy
+
+    def testBytes(self):
+        self.assertEqual(list(nRuns(b'ACNNGTnA', chunkSize=3)),
+                         [(2, 4), (6, 7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from collections import defaultdict
+
+try:
+    from remove_overlap import FalseDup, trim_records, trim_sequence
+except ImportError:  # sonLib is not installed
+    trim_records = None
+
+
+def trimByDeletion(sequence, dups, additional=0):
+    """Trims the dups by marking every base to cut, one at a time."""
+    cut = set()
+    for dup in dups:
+        cut.update(range(max(0, dup.gapStart - dup.dupSize - additional),
+                         dup.gapStart))
+        cut.update(range(dup.gapEnd, dup.gapEnd + dup.dupSize + additional))
+    return ''.join(base for i, base in enumerate(sequence) if i not in cut)
+
+
+@unittest.skipIf(trim_records is None, 'needs sonLib')
+class TrimSequenceTest(unittest.TestCase):
+    SEQUENCE = 'ACGTACGTAC' * 3 + 'NNNNN' + 'TTGGCCAATT' * 3 + 'NNN' + \
+        'GATTACA' * 4
+
+    def check(self, dups, additional=0):
+        self.assertEqual(trim_sequence(self.SEQUENCE, dups, additional),
+                         trimByDeletion(self.SEQUENCE, dups, additional))
+
+    def testSeparateDups(self):
+        self.check([FalseDup(30, 35, 4), FalseDup(65, 68, 6)])
+
+    def testOverlappingCuts(self):
+        # the cut after the first gap runs into the cut before the second
+        self.check([FalseDup(30, 35, 20), FalseDup(65, 68, 20)])
+        self.check([FalseDup(30, 35, 12), FalseDup(65, 68, 12)],
+                   additional=10)
+
+    def testCutsClippedToSequence(self):
+        self.check([FalseDup(30, 35, 40)], additional=5)
+        self.check([FalseDup(65, 68, 30)], additional=5)
+
+    def testUnsortedDups(self):
+        self.check([FalseDup(65, 68, 6), FalseDup(30, 35, 4)])
+
+    def testNoDups(self):
+        self.check([])
+
+
+@unittest.skipIf(trim_records is None, 'needs sonLib')
+class TrimRecordsTest(unittest.TestCase):
+    def testMatchesOnSequenceName(self):
+        # .dups files name sequences by the first word of their header
+        dups = defaultdict(list, scaf=[FalseDup(10, 15, 3)])
+        records = [('scaf some description', 'A' * 10 + 'N' * 5 + 'C' * 10),
+                   ('other', 'ACGT')]
+        self.assertEqual(list(trim_records(records, dups)),
+                         [('scaf some description',
+                           'A' * 7 + 'N' * 5 + 'C' * 7),
+                          ('other', 'ACGT')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from genomes import SEQUENCES, nRuns, touch, write2bit, writeFasta
+from decodedGenome import DecodedGenome, decodedPath, openDecodedGenome
+from gapIndex import GapIndex, openGapIndex, sidecarPath
+from gapTable import GapTable, collectGaps, writeGapTable
+
+CHANGED = [(name, sequence.replace('NNNNN', 'ACGTA', 1))
+           for name, sequence in SEQUENCES]
+
+
+class SidecarTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.assemblies = [os.path.join(self.directory, 'test.2bit'),
+                           os.path.join(self.directory, 'test.fa')]
+        write2bit(self.assemblies[0], SEQUENCES)
+        writeFasta(self.assemblies[1], SEQUENCES)
+
+        # fallback sidecars go in the temporary directory
+        self.tempdir = tempfile.tempdir
+        tempfile.tempdir = os.path.join(self.directory, 'tmp')
+        os.mkdir(tempfile.tempdir)
+
+    def tearDown(self):
+        tempfile.tempdir = self.tempdir
+        shutil.rmtree(self.directory)
+
+    def block(self, path):
+        """Makes path unwritable as a sidecar, as in a read-only
+        directory."""
+        os.mkdir(path)
+
+    def rewrite(self, assembly, sequences):
+        """Rewrites an assembly in place, keeping its size."""
+        mtime = os.stat(assembly).st_mtime
+        if assembly.endswith('.2bit'):
+            write2bit(assembly, sequences)
+        else:
+            writeFasta(assembly, sequences)
+        touch(assembly, mtime + 10)
+
+
+class GapIndexTest(SidecarTest):
+    def checkGaps(self, index, sequences):
+        self.assertEqual(index.sequence_sizes(),
+                         dict((name, len(sequence))
+                              for name, sequence in sequences))
+        for name, sequence in sequences:
+            self.assertEqual(index.gaps(name), nRuns(sequence))
+        self.assertEqual(index.gapCount(),
+                         sum(len(nRuns(sequence)) for _, sequence in sequences))
+
+    def maskBlocks(self, assembly, sequence):
+        """Soft-masked blocks a genome holds: a 2bit file's mask blocks,
+        and none for FASTA."""
+        if not assembly.endswith('.2bit'):
+            return 0
+        return len(re.findall('[a-z]+', sequence))
+
+    def testWriteAndRead(self):
+        for assembly in self.assemblies:
+            index = openGapIndex(assembly)
+            self.assertEqual(index.path, sidecarPath(assembly))
+            self.checkGaps(index, SEQUENCES)
+            self.checkGaps(GapIndex(sidecarPath(assembly)), SEQUENCES)
+            self.assertTrue(index.matches(assembly))
+            self.assertEqual(index.names(), [name for name, _ in SEQUENCES])
+
+    def testMaskBlockCounts(self):
+        for assembly in self.assemblies:
+            index = openGapIndex(assembly)
+            for name, sequence in SEQUENCES:
+                self.assertEqual(index.maskBlockCount(name),
+                                 self.maskBlocks(assembly, sequence))
+            self.assertEqual(index.maskBlockCount(),
+                             sum(self.maskBlocks(assembly, sequence)
+                                 for _, sequence in SEQUENCES))
+
+    def testStaleIndexIsRebuilt(self):
+        for assembly in self.assemblies:
+            openGapIndex(assembly).close()
+            self.rewrite(assembly, CHANGED)
+            self.assertFalse(GapIndex(sidecarPath(assembly)).matches(assembly))
+            self.checkGaps(openGapIndex(assembly), CHANGED)
+
+    def testTouchedAssemblyKeepsIndex(self):
+        for assembly in self.assemblies:
+            openGapIndex(assembly).close()
+            self.rewrite(assembly, SEQUENCES)
+            self.checkGaps(openGapIndex(assembly), SEQUENCES)
+            self.assertEqual(GapIndex(sidecarPath(assembly)).sourceMtime,
+                             os.stat(assembly).st_mtime)
+
+    def testUnwritableDirectory(self):
+        for assembly in self.assemblies:
+            self.block(sidecarPath(assembly))
+            index = openGapIndex(assembly)
+            self.assertEqual(os.path.dirname(index.path),
+                             tempfile.gettempdir())
+            self.checkGaps(index, SEQUENCES)
+            self.assertEqual(openGapIndex(assembly).path, index.path)
+
+    def testSharedDirectory(self):
+        shared = os.path.join(self.directory, 'shared')
+        os.mkdir(shared)
+        for assembly in self.assemblies:
+            self.block(sidecarPath(assembly))
+            with self.assertRaises(ValueError):
+                openGapIndex(assembly, directory=shared, build=False)
+            index = openGapIndex(assembly, directory=shared)
+            self.assertEqual(os.path.dirname(index.path), shared)
+            reopened = openGapIndex(assembly, directory=shared, build=False)
+            self.assertEqual(reopened.path, index.path)
+            self.checkGaps(reopened, SEQUENCES)
+            self.rewrite(assembly, CHANGED)
+            with self.assertRaises(ValueError):
+                openGapIndex(assembly, directory=shared, build=False)
+
+
+class DecodedGenomeTest(SidecarTest):
+    def checkBases(self, genome, sequences):
+        self.assertEqual(genome.sequence_sizes(),
+                         dict((name, len(sequence))
+                              for name, sequence in sequences))
+        for name, sequence in sequences:
+            self.assertEqual(str(genome[name]), sequence.upper())
+            self.assertEqual(genome[name][3:17], sequence[3:17].upper())
+            self.assertEqual(genome[name][-2:], sequence[-2:].upper())
+
+    def testWriteAndRead(self):
+        for assembly in self.assemblies:
+            genome = openDecodedGenome(assembly)
+            self.assertEqual(genome.path, decodedPath(assembly))
+            self.checkBases(genome, SEQUENCES)
+            self.checkBases(DecodedGenome(decodedPath(assembly)), SEQUENCES)
+            self.assertEqual(genome.sequence_names(),
+                             [name for name, _ in SEQUENCES])
+
+    def testStaleGenomeIsRebuilt(self):
+        for assembly in self.assemblies:
+            openDecodedGenome(assembly)
+            self.rewrite(assembly, CHANGED)
+            self.assertFalse(DecodedGenome(decodedPath(assembly))
+                             .matches(assembly))
+            self.checkBases(openDecodedGenome(assembly), CHANGED)
+
+    def testUnwritableDirectory(self):
+        for assembly in self.assemblies:
+            self.block(decodedPath(assembly))
+            genome = openDecodedGenome(assembly)
+            self.assertEqual(os.path.dirname(genome.path),
+                             tempfile.gettempdir())
+            self.checkBases(genome, SEQUENCES)
+            self.assertEqual(openDecodedGenome(assembly).path, genome.path)
+
+    def testSharedDirectory(self):
+        shared = os.path.join(self.directory, 'shared')
+        os.mkdir(shared)
+        for assembly in self.assemblies:
+            self.block(decodedPath(assembly))
+            with self.assertRaises(ValueError):
+                openDecodedGenome(assembly, directory=shared, build=False)
+            genome = openDecodedGenome(assembly, directory=shared)
+            self.assertEqual(os.path.dirname(genome.path), shared)
+            reopened = openDecodedGenome(assembly, directory=shared,
+                                         build=False)
+            self.assertEqual(reopened.path, genome.path)
+            self.checkBases(reopened, SEQUENCES)
+            self.rewrite(assembly, CHANGED)
+            with self.assertRaises(ValueError):
+                openDecodedGenome(assembly, directory=shared, build=False)
+
+
+class GapTableTest(SidecarTest):
+    def testWriteAndRead(self):
+        gaps = collectGaps(self.assemblies[0], 8)
+        path = os.path.join(self.directory, 'test.gaptable')
+        writeGapTable(path, gaps)
+        table = GapTable(path)
+        expected = []
+        for name, sequence in SEQUENCES:
+            for start, end in nRuns(sequence):
+                before, after = max(0, start - 8), min(len(sequence), end + 8)
+                if start - before > 5 and after - end > 5:
+                    expected.append((name, start, end, before, after))
+        self.assertEqual(len(table), len(expected))
+        self.assertEqual([tuple(gap) for gap in table.gaps(0, len(table))],
+                         expected)
+        self.assertEqual([tuple(gap) for gap in table.gaps(1, 2)],
+                         expected[1:2])
+        self.assertEqual(list(table.column('ends', 0, len(table))),
+                         [gap[2] for gap in expected])
+        table.close()
+
+    def testLargePositions(self):
+        gaps = collectGaps(self.assemblies[0], 8)
+        gaps.append(0, 1 << 40, (1 << 40) + 10, (1 << 40) - 8, (1 << 40) + 18)
+        path = os.path.join(self.directory, 'test.gaptable')
+        writeGapTable(path, gaps)
+        table = GapTable(path)
+        self.assertEqual(tuple(list(table.gaps(0, len(table)))[-1]),
+                         (SEQUENCES[0][0], 1 << 40, (1 << 40) + 10,
+                          (1 << 40) - 8, (1 << 40) + 18))
+        table.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
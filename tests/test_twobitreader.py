@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from genomes import SEQUENCES, nRuns, touch, write2bit
+from twobitreader import TwoBitFile
+
+
+class TwoBitFormatTest(unittest.TestCase):
+    """Version 0 and 1 files in both byte orders read back as written."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, version, byteorder):
+        path = os.path.join(self.directory, 'test.2bit')
+        write2bit(path, SEQUENCES, version, byteorder)
+        genome = TwoBitFile(path)
+        self.assertEqual(genome.sequence_names(),
+                         [name for name, _ in SEQUENCES])
+        self.assertEqual(genome.sequence_sizes(),
+                         dict((name, len(sequence))
+                              for name, sequence in SEQUENCES))
+        for name, sequence in SEQUENCES:
+            self.assertEqual(str(genome[name]), sequence)
+            for start in range(0, len(sequence), 7):
+                for end in (start + 1, start + 13, len(sequence)):
+                    self.assertEqual(genome[name][start:end],
+                                     sequence[start:end])
+                    self.assertEqual(genome[name].get_upper_slice(start, end),
+                                     sequence[start:end].upper())
+            self.assertEqual(list(genome[name].n_blocks()), nRuns(sequence))
+            self.assertEqual(genome[name].masked_bases(0, len(sequence)),
+                             sum(1 for base in sequence if base.islower()))
+
+    def testVersion0LittleEndian(self):
+        self.check(0, '<')
+
+    def testVersion0BigEndian(self):
+        self.check(0, '>')
+
+    def testVersion1LittleEndian(self):
+        self.check(1, '<')
+
+    def testVersion1BigEndian(self):
+        self.check(1, '>')
+
+    def testCachedSlices(self):
+        path = os.path.join(self.directory, 'test.2bit')
+        write2bit(path, SEQUENCES)
+        genome = TwoBitFile(path, cache_bytes=1 << 20)
+        for name, sequence in SEQUENCES:
+            for _ in range(2):
+                self.assertEqual(genome[name][3:40], sequence[3:40])
+
+
+class OffsetIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.2bit')
+        self.offsets = self.path + '.offsets'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testWriteAndRead(self):
+        write2bit(self.path, SEQUENCES, 1, '>')
+        genome = TwoBitFile(self.path, offset_index=self.offsets)
+        self.assertTrue(os.path.exists(self.offsets))
+        self.assertTrue(genome._read_offset_index(self.offsets))
+        reopened = TwoBitFile(self.path, offset_index=self.offsets)
+        self.assertEqual(reopened.sequence_names(),
+                         [name for name, _ in SEQUENCES])
+        for name, sequence in SEQUENCES:
+            self.assertEqual(str(reopened[name]), sequence)
+
+    def testStaleIndexIsRebuilt(self):
+        write2bit(self.path, SEQUENCES)
+        TwoBitFile(self.path, offset_index=self.offsets)
+        changed = [(name + 'x', sequence) for name, sequence in SEQUENCES]
+        write2bit(self.path, changed)
+        touch(self.path, os.stat(self.path).st_mtime + 10)
+        genome = TwoBitFile(self.path, offset_index=self.offsets)
+        self.assertEqual(sorted(genome.keys()),
+                         sorted(name for name, _ in changed))
+        self.assertTrue(genome._read_offset_index(self.offsets))
+
+    def testUnreadableIndexIsIgnored(self):
+        write2bit(self.path, SEQUENCES)
+        with open(self.offsets, 'wb') as f:
+            f.write(b'not an index')
+        genome = TwoBitFile(self.path, offset_index=self.offsets)
+        for name, sequence in SEQUENCES:
+            self.assertEqual(str(genome[name]), sequence)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,17 +5,22 @@ Licensed under Perl Artistic License 2.0
 No warranty is provided, express or implied
 """
 from array import array
-from bisect import bisect_right
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from errno import ENOENT, EACCES
-from os import R_OK, access
+from os import R_OK, access, fdopen, remove, rename, stat
 
 try:
     from os import strerror
 except ImportError:
     strerror = lambda x: 'strerror not supported'
-from os.path import exists, getsize
+from os.path import abspath, dirname, exists, getsize
+from tempfile import mkstemp
 import logging
+import marshal
+import struct
 import textwrap
+import threading
 import sys
 
 if sys.version_info > (3,):
@@ -40,6 +45,15 @@ def safe_tostring(ary):
         return ary.tostring()
 
 
+def array_bytes(ary):
+    """
+    the raw bytes of an array; tostring() is gone from Python 3.9
+    """
+    if hasattr(ary, 'tobytes'):
+        return ary.tobytes()
+    return ary.tostring()
+
+
 def true_long_type():
     """
     OS X uses an 8-byte long, so make sure L (long) is the right size
@@ -56,6 +70,26 @@ as equivalent to LONG")
 
 LONG = true_long_type()
 
+TWOBIT_SIGNATURE = 0x1A412743
+# the header and index are parsed with these, in the file's byte order
+if sys.byteorder == 'little':
+    _NATIVE, _SWAPPED = '<', '>'
+else:
+    _NATIVE, _SWAPPED = '>', '<'
+_HEADER = dict((endian, struct.Struct(endian + 'IIII'))
+               for endian in '<>')
+# version 0 files have 32-bit sequence offsets, version 1 files 64-bit
+_OFFSET = dict(((endian, version), struct.Struct(endian + code))
+               for endian in '<>' for version, code in ((0, 'I'), (1, 'Q')))
+# index entries are guessed to be this long when reading the index
+_INDEX_ENTRY_GUESS = 24
+
+# a persisted name->offset index: magic, size and mtime of the 2bit file,
+# python major version (which fixes the marshal string type), then the
+# marshalled list of (name, offset)
+_OFFSET_INDEX_MAGIC = b'2BITOFS1'
+_OFFSET_INDEX_HEADER = struct.Struct('<8sQdI')
+
 
 def byte_to_bases(x):
     """convert one byte to the four bases it encodes"""
@@ -70,13 +104,13 @@ def byte_to_bases(x):
 
 def bits_to_base(x):
     """convert integer representation of two bits to correct base"""
-    if x is 0:
+    if x == 0:
         return 'T'
-    elif x is 1:
+    elif x == 1:
         return 'C'
-    elif x is 2:
+    elif x == 2:
         return 'A'
-    elif x is 3:
+    elif x == 3:
         return 'G'
     else:
         raise ValueError('Only integers 0-3 are valid inputs')
@@ -100,11 +134,11 @@ def base_to_bin(x):
 
 
 def create_byte_table():
-    """create BYTE_TABLE"""
-    d = {}
-    for x in xrange(2 ** 8):
-        d[x] = byte_to_bases(x)
-    return d
+    """
+    create BYTE_TABLE: a tuple whose entry x is the four bases encoded by
+    byte x, as a string
+    """
+    return tuple(''.join(byte_to_bases(x)) for x in xrange(2 ** 8))
 
 
 def split16(x):
@@ -118,7 +152,11 @@ def split16(x):
 
 
 def create_twobyte_table():
-    """create TWOBYTE_TABLE"""
+    """
+    create a 65,536-entry table of the eight bases encoded by each 16-bit
+    word. This is not used when decoding and is no longer built at import
+    time; call it directly if you need it.
+    """
     d = {}
     for x in xrange(2 ** 16):
         c, f = split16(x)
@@ -126,8 +164,10 @@ def create_twobyte_table():
     return d
 
 
+# BYTE_TABLE[x] is the four bases encoded by byte x. The 2-bit codes are
+# T=0, C=1, A=2, G=3 with the first base in the most significant bits, so
+# the table is every 4-mer over 'TCAG' in lexicographic order.
 BYTE_TABLE = create_byte_table()
-TWOBYTE_TABLE = create_twobyte_table()
 
 
 def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size,
@@ -168,8 +208,7 @@ def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size,
     # this method ensures correct endianess (byteswap as neeed)
     i = 0
     if longs_len > 0:
-        bytes_ = array('B')
-        bytes_.fromstring(longs.tostring())
+        bytes_ = array('B', array_bytes(longs))
         # first block
         first_block = ''.join([''.join(BYTE_TABLE[bytes_[x]]) for x in range(4)])
         i = 16 - first_base_offset
@@ -178,9 +217,9 @@ def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size,
         dna[0:i] = array(_CHAR_CODE, first_block[first_base_offset:first_base_offset + i])
     if longs_len > 1:
         # middle blocks (implicitly skipped if they don't exist)
-        for byte in bytes_[4:-4]:
-            dna[i:i + 4] = array(_CHAR_CODE, BYTE_TABLE[byte])
-            i += 4
+        middle = ''.join([BYTE_TABLE[byte] for byte in bytes_[4:-4]])
+        dna[i:i + len(middle)] = array(_CHAR_CODE, middle)
+        i += len(middle)
         # last block
         last_block = array(_CHAR_CODE, ''.join([''.join(BYTE_TABLE[bytes_[x]])
                                                 for x in range(-4, 0)]))
@@ -190,8 +229,7 @@ def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size,
             dna[i:i + 16] = last_block[0:16]
         i += 16
     if more_bytes is not None:
-        bytes_ = array('B')
-        bytes_.fromstring(more_bytes)
+        bytes_ = array('B', more_bytes)
         j = i
         for byte in bytes_:
             j = i + 4
@@ -204,6 +242,59 @@ def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size,
     return dna[0:array_size]
 
 
+class BlockCache(object):
+    """
+    bounded LRU cache of decoded sequence blocks, shared by the sequences
+    of a TwoBitFile
+
+    Blocks are block_size bases long and are stored upper-case with the
+    N-blocks applied (soft-masking is applied per slice), so get_slice and
+    get_upper_slice can both use them. The cache holds at most max_bytes of
+    decoded sequence and is safe to share between threads; hits and misses
+    count block lookups.
+    """
+
+    def __init__(self, max_bytes, block_size=16384):
+        if block_size % 16 != 0:
+            raise ValueError('block_size must be a multiple of 16')
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        # serializes decoding, which seeks the shared file handle
+        self.io_lock = threading.Lock()
+
+    def get(self, key):
+        """returns the cached block for key, or None"""
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks[key] = block  # now most recently used
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._blocks or len(block) > self.max_bytes:
+                return
+            self._blocks[key] = block
+            self._bytes += len(block)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        """returns a dictionary of hits, misses, blocks and bytes cached"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'blocks': len(self._blocks), 'bytes': self._bytes}
+
+
 class TwoBitFile(dict):
     """
 python-level reader for .2bit files (i.e., from UCSC genome browser)
@@ -224,10 +315,21 @@ tttgcatgttaagtttttttcc'
 
 Fair warning: dumping the entire chromosome requires a lot of memory
 
+To serve repeated and overlapping slices from memory, give a cache size in
+bytes; decoded blocks are then kept in a BlockCache shared by all sequences
+>>> genome = TwoBitFile('hg18.2bit', cache_bytes=64 * 1024 ** 2)
+>>> genome.cache.stats()
+
+Both version 0 files and version 1 files (64-bit offsets, for genomes over
+4 gig) are read. Opening a file with hundreds of thousands of sequences is
+faster still if the name->offset index is persisted: with offset_index, it
+is loaded from that path if it is up to date, and written there otherwise
+>>> genome = TwoBitFile('hg18.2bit', offset_index='hg18.2bit.offsets')
+
 See TwoBitSequence for more info
     """
 
-    def __init__(self, foo):
+    def __init__(self, foo, cache_bytes=0, offset_index=None):
         super(TwoBitFile, self).__init__()
         if not exists(foo):
             raise IOError(ENOENT, strerror(ENOENT), foo)
@@ -236,67 +338,151 @@ See TwoBitSequence for more info
         self._filename = foo
         self._file_size = getsize(foo)
         self._file_handle = open(foo, 'rb')
+        self._cache_bytes = cache_bytes
+        if cache_bytes > 0:
+            self.cache = BlockCache(cache_bytes)
+        else:
+            self.cache = None
+        self._offset_index = offset_index
         self._load_header()
-        self._load_index()
+        if offset_index is None or not self._read_offset_index(offset_index):
+            self._load_index()
+            if offset_index is not None:
+                try:
+                    self.save_offset_index(offset_index)
+                except (IOError, OSError):
+                    pass  # read-only directory; parse the index next time
         for name, offset in iteritems(self._offset_dict):
             self[name] = TwoBitSequence(self._file_handle, offset,
                                         self._file_size,
-                                        self._byteswapped)
+                                        self._byteswapped,
+                                        cache=self.cache)
         return
 
     def __reduce__(self): # enables pickling
-        return (TwoBitFile,(self._filename,))
+        return (TwoBitFile,(self._filename, self._cache_bytes,
+                            self._offset_index))
 
     def _load_header(self):
         file_handle = self._file_handle
-        header = array(LONG)
-        header.fromfile(file_handle, 4)
+        file_handle.seek(0)
+        header = file_handle.read(16)
+        if len(header) < 16:
+            raise TwoBitFileError('File is too short for a header.')
         # check signature -- must be 0x1A412743
         # if not, swap bytes
         byteswapped = False
-        (signature, version, sequence_count, reserved) = header
-        if not signature == 0x1A412743:
+        endian = _NATIVE
+        (signature, version, sequence_count, reserved) = \
+            _HEADER[endian].unpack(header)
+        if not signature == TWOBIT_SIGNATURE:
             byteswapped = True
-            header.byteswap()
-            (signature2, version, sequence_count, reserved) = header
-            if not signature2 == 0x1A412743:
+            endian = _SWAPPED
+            (signature2, version, sequence_count, reserved) = \
+                _HEADER[endian].unpack(header)
+            if not signature2 == TWOBIT_SIGNATURE:
                 raise TwoBitFileError('Signature in header should be ' +
                                       '0x1A412743, instead found 0x%X' %
                                       signature)
-        if not version == 0:
-            raise TwoBitFileError('File version in header should be 0.')
+        if version not in (0, 1):
+            raise TwoBitFileError('File version in header should be 0 or 1.')
         if not reserved == 0:
             raise TwoBitFileError('Reserved field in header should be 0.')
         self._byteswapped = byteswapped
+        self._endian = endian
+        self._version = version
         self._sequence_count = sequence_count
 
     def _load_index(self):
+        """
+        parse the index from bulk reads rather than field by field
+        """
         file_handle = self._file_handle
-        byteswapped = self._byteswapped
+        offset_struct = _OFFSET[(self._endian, self._version)]
+        offset_size = offset_struct.size
+        unpack_offset = offset_struct.unpack_from
         remaining = self._sequence_count
         sequence_offsets = []
         file_handle.seek(16)
+        buf = file_handle.read(remaining * _INDEX_ENTRY_GUESS)
+        pos = 0
+        at_eof = False
         while remaining > 0:
-            name_size = array('B')
-            name_size.fromfile(file_handle, 1)
-            if byteswapped:
-                name_size.byteswap()
-            # name = array(_CHAR_CODE)
-            name = array('B')
-            name.fromfile(file_handle, name_size[0])
-            name = "".join([chr(X) for X in name])
-
-            if byteswapped:
-                name.byteswap()
-            offset = array(LONG)
-            offset.fromfile(file_handle, 1)
-            if byteswapped:
-                offset.byteswap()
-            sequence_offsets.append((name, offset[0]))
+            # the longest possible entry is a 255-byte name and its offset
+            if pos + 256 + offset_size > len(buf) and not at_eof:
+                more = file_handle.read(max(1 << 16,
+                                            remaining * _INDEX_ENTRY_GUESS))
+                at_eof = len(more) == 0
+                buf = buf[pos:] + more
+                pos = 0
+            name_size = ord(buf[pos:pos + 1])
+            name_end = pos + 1 + name_size
+            if name_end + offset_size > len(buf):
+                raise TwoBitFileError('Index is truncated.')
+            name = buf[pos + 1:name_end]
+            if not isinstance(name, str):
+                name = name.decode('ascii')
+            sequence_offsets.append((name, unpack_offset(buf, name_end)[0]))
+            pos = name_end + offset_size
             remaining -= 1
         self._sequence_offsets = sequence_offsets
         self._offset_dict = dict(sequence_offsets)
 
+    def save_offset_index(self, path):
+        """
+        persist the name->offset index to path, for later TwoBitFiles to
+        load with offset_index=path instead of parsing the 2bit index
+        the file is written under a temporary name and renamed into place,
+        so concurrent readers never see it half-written
+        """
+        file_stat = stat(self._filename)
+        handle, temp_path = mkstemp(dir=dirname(abspath(path)),
+                                    suffix='.tmp')
+        try:
+            with fdopen(handle, 'wb') as f:
+                f.write(_OFFSET_INDEX_HEADER.pack(_OFFSET_INDEX_MAGIC,
+                                                  file_stat.st_size,
+                                                  file_stat.st_mtime,
+                                                  sys.version_info[0]))
+                marshal.dump(self._sequence_offsets, f)
+            rename(temp_path, path)
+        except Exception:
+            remove(temp_path)
+            raise
+
+    def _read_offset_index(self, path):
+        """
+        load a persisted name->offset index, returning False if it is
+        missing or was not written from this file as it is now
+        """
+        if not exists(path):
+            return False
+        file_stat = stat(self._filename)
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(_OFFSET_INDEX_HEADER.size)
+                if len(header) < _OFFSET_INDEX_HEADER.size:
+                    return False
+                magic, size, mtime, python_version = \
+                    _OFFSET_INDEX_HEADER.unpack(header)
+                if magic != _OFFSET_INDEX_MAGIC or \
+                        size != file_stat.st_size or \
+                        mtime != file_stat.st_mtime or \
+                        python_version != sys.version_info[0]:
+                    return False
+                sequence_offsets = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        if len(sequence_offsets) != self._sequence_count:
+            return False
+        self._sequence_offsets = sequence_offsets
+        self._offset_dict = dict(sequence_offsets)
+        return True
+
+    def sequence_names(self):
+        """returns the sequence names in the order of the file's index"""
+        return [name for name, _ in self._sequence_offsets]
+
     def sequence_sizes(self):
         """returns a dictionary with the sizes of each sequence"""
         d = {}
@@ -341,7 +527,9 @@ d = x.dict()
 for k,v in d.items(): d[k] = str(v)
     """
 
-    def __init__(self, file_handle, offset, file_size, byteswapped=False):
+    def __init__(self, file_handle, offset, file_size, byteswapped=False,
+                 cache=None):
+        self._cache = cache
         self._file_size = file_size
         self._file_handle = file_handle
         self._original_offset = offset
@@ -404,11 +592,11 @@ for k,v in d.items(): d[k] = str(v)
                 max_ = None
             return self.get_slice(min_=slice_or_key, max_=max_)
 
-    def get_slice(self, min_, max_=None):
+    def _normalize_range(self, min_, max_):
         """
-        get_slice returns only a sub-sequence
+        resolve None/negative coordinates, returning (min_, max_) or None
+        if the range is empty
         """
-        # handle negative coordinates
         dna_size = self._dna_size
         if min_ is None:  # for slicing e.g. [:]
             min_ = 0
@@ -422,29 +610,30 @@ for k,v in d.items(): d[k] = str(v)
             min_ = dna_size + min_
         # make sure there's a proper range
         if max_ is not None and min_ > max_:
-            return ''
+            return None
         if max_ == 0 or max_ == min_:
-            return ''
+            return None
 
         # load all the data
         if max_ is None or max_ > dna_size:
             max_ = dna_size
+        if min_ == max_:
+            return None
+        return min_, max_
 
+    def _hard_masked_array(self, min_, max_):
+        """
+        decode bases [min_, max_) into an upper-case char array with the
+        N-blocks applied but without soft-masking
+        """
         file_handle = self._file_handle
-        byteswapped = self._byteswapped
         n_block_starts = self._n_block_starts
         n_block_sizes = self._n_block_sizes
-        mask_block_starts = self._mask_block_starts
-        mask_block_sizes = self._mask_block_sizes
         offset = self._offset
         packed_dna_size = self._packed_dna_size
-        # n_bytes = self._n_bytes
 
         # region_size is how many bases the region is
-        if max_ is None:
-            region_size = dna_size - min_
-        else:
-            region_size = max_ - min_
+        region_size = max_ - min_
 
         # start_block, end_block are the first/last 32-bit blocks we need
         # blocks start at 0
@@ -477,17 +666,19 @@ for k,v in d.items(): d[k] = str(v)
         else:
             fourbyte_dna.fromfile(file_handle, blocks_to_read)
             morebytes = None
-        if byteswapped:
-            fourbyte_dna.byteswap()
+        # packedDna is a byte string, so unlike the other fields it is never
+        # byte-swapped
         str_as_array = longs_to_char_array(fourbyte_dna, first_base_offset,
                                            last_base_offset, region_size,
                                            more_bytes=morebytes)
-        for start, size in izip(n_block_starts, n_block_sizes):
+        # only visit the N-blocks overlapping [min_, max_)
+        first_n_block = max(0, bisect_right(n_block_starts, min_) - 1)
+        last_n_block = bisect_left(n_block_starts, max_, lo=first_n_block)
+        for start, size in izip(n_block_starts[first_n_block:last_n_block],
+                                n_block_sizes[first_n_block:last_n_block]):
             end = start + size
             if end <= min_:
                 continue
-            if start > max_:
-                break
             if start < min_:
                 start = min_
             if end > max_:
@@ -496,6 +687,48 @@ for k,v in d.items(): d[k] = str(v)
             end -= min_
             # this should actually be decoded, 00=N, 01=n
             str_as_array[start:end] = array(_CHAR_CODE, 'N' * (end - start))
+        if not len(str_as_array) == max_ - min_:
+            raise RuntimeError("Sequence was the wrong size")
+        return str_as_array
+
+    def _hard_masked_string(self, min_, max_):
+        """
+        like _hard_masked_array, but returns a string and goes through the
+        block cache, if there is one
+        """
+        cache = self._cache
+        if cache is None:
+            return safe_tostring(self._hard_masked_array(min_, max_))
+        block_size = cache.block_size
+        pieces = []
+        for block in xrange(min_ // block_size, (max_ - 1) // block_size + 1):
+            block_start = block * block_size
+            key = (self._original_offset, block)
+            data = cache.get(key)
+            if data is None:
+                block_end = min(block_start + block_size, self._dna_size)
+                with cache.io_lock:
+                    data = safe_tostring(self._hard_masked_array(block_start,
+                                                                 block_end))
+                cache.put(key, data)
+            pieces.append(data[max(0, min_ - block_start):max_ - block_start])
+        return ''.join(pieces)
+
+    def get_slice(self, min_, max_=None):
+        """
+        get_slice returns only a sub-sequence
+        """
+        region = self._normalize_range(min_, max_)
+        if region is None:
+            return ''
+        min_, max_ = region
+        mask_block_starts = self._mask_block_starts
+        mask_block_sizes = self._mask_block_sizes
+        if self._cache is None:
+            str_as_array = self._hard_masked_array(min_, max_)
+        else:
+            str_as_array = array(_CHAR_CODE,
+                                 self._hard_masked_string(min_, max_))
         lower = str.lower
         first_masked_region = max(0,
                                   bisect_right(mask_block_starts, min_) - 1)
@@ -519,10 +752,67 @@ for k,v in d.items(): d[k] = str(v)
             end -= min_
             str_as_array[start:end] = array(_CHAR_CODE,
                                             lower(safe_tostring(str_as_array[start:end])))
-        if not len(str_as_array) == max_ - min_:
-            raise RuntimeError("Sequence was the wrong size")
         return safe_tostring(str_as_array)
 
+    def get_upper_slice(self, min_, max_=None):
+        """
+        get_upper_slice returns a sub-sequence like get_slice, but entirely
+        upper-case: the soft mask is never applied, which saves the work of
+        walking the mask blocks when the caller would call .upper() anyway
+        """
+        region = self._normalize_range(min_, max_)
+        if region is None:
+            return ''
+        return self._hard_masked_string(*region)
+
+    def masked_bases(self, min_, max_=None):
+        """
+        returns how many bases in [min_, max_) are soft-masked, from the
+        mask-block index alone, without decoding any sequence
+        """
+        region = self._normalize_range(min_, max_)
+        if region is None:
+            return 0
+        min_, max_ = region
+        mask_block_starts = self._mask_block_starts
+        mask_block_sizes = self._mask_block_sizes
+        masked = 0
+        i = max(0, bisect_right(mask_block_starts, min_) - 1)
+        while i < len(mask_block_starts) and mask_block_starts[i] < max_:
+            start = max(min_, mask_block_starts[i])
+            end = min(max_, mask_block_starts[i] + mask_block_sizes[i])
+            if end > start:
+                masked += end - start
+            i += 1
+        return masked
+
+    def mask_block_count(self):
+        """
+        returns the number of soft-masked blocks in the sequence's index,
+        all of which are held in memory while the file is open
+        """
+        return len(self._mask_block_starts)
+
+    def n_blocks(self):
+        """
+        yields (start, end) for each run of Ns straight from the N-block
+        index, without decoding any sequence
+        abutting blocks are merged, so this matches a scan of str(self)
+        for runs of [Nn]
+        """
+        run_start = run_end = None
+        for start, size in izip(self._n_block_starts, self._n_block_sizes):
+            if size == 0:
+                continue
+            if run_end == start:
+                run_end = start + size
+                continue
+            if run_start is not None:
+                yield run_start, run_end
+            run_start, run_end = start, start + size
+        if run_start is not None:
+            yield run_start, run_end
+
     def __str__(self):
         """
         returns the entire chromosome
@@ -558,7 +848,9 @@ following fields:
 signature - the number 0x1A412743 in the architecture of the machine that \
 created the file.
 version - zero for now. Readers should abort if they see a version number \
-higher than 0.
+higher than 0. (Version 1 files, written by UCSC tools for genomes over 4 \
+gig, are the same except that the index offsets are 64 bits; this reader \
+supports both.)
 sequenceCount - the number of sequences in the file
 reserved - always zero for now.
 All fields are 32 bits unless noted. If the signature value is not as given, \